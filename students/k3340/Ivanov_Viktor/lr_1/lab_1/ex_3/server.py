@@ -1,11 +1,28 @@
 import socket
 import os
+import sys
 import mimetypes
 
+# движок шаблонов общий с заданием 5
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ex_5'))
+from template import Template
+
 # параметры сервера
 HOST = 'localhost'
 PORT = 8082
 
+# страница ошибки разбирается один раз, 404 и 500 отличаются только подстановками
+ERROR_PAGE = Template.from_string("""
+<html>
+<head><title>{{CODE}} {{REASON}}</title></head>
+<body>
+    <h1>{{CODE}} - {{TITLE}}</h1>
+    <p>{{MESSAGE}}</p>
+    {{LINK}}
+</body>
+</html>
+""")
+
 def get_file_content(filename):
     """чтение содержимого файла"""
     try:
@@ -44,6 +61,10 @@ def create_http_response(status_code, content_type, content):
     
     return response.encode('utf-8') + content
 
+def render_error_page(status_code, reason, title, message, link=''):
+    """страница ошибки из шаблона ERROR_PAGE"""
+    return ERROR_PAGE.render(CODE=status_code, REASON=reason, TITLE=title, MESSAGE=message, LINK=link)
+
 def handle_request(request_data):
     """обработка HTTP-запроса"""
     try:
@@ -78,16 +99,9 @@ def handle_request(request_data):
         
         if content is None:
             # файл не найден
-            error_content = """
-            <html>
-            <head><title>404 Not Found</title></head>
-            <body>
-                <h1>404 - Страница не найдена</h1>
-                <p>Запрашиваемый файл не найден на сервере.</p>
-                <a href="/">Вернуться на главную</a>
-            </body>
-            </html>
-            """.encode('utf-8')
+            error_content = render_error_page(404, 'Not Found', 'Страница не найдена',
+                                              'Запрашиваемый файл не найден на сервере.',
+                                              '<a href="/">Вернуться на главную</a>')
             return create_http_response(404, 'text/html', error_content)
         
         # определяем MIME-тип
@@ -98,15 +112,8 @@ def handle_request(request_data):
         
     except Exception as e:
         print(f"Ошибка обработки запроса: {e}")
-        error_content = """
-        <html>
-        <head><title>500 Internal Server Error</title></head>
-        <body>
-            <h1>500 - Внутренняя ошибка сервера</h1>
-            <p>Произошла ошибка при обработке запроса.</p>
-        </body>
-        </html>
-        """.encode('utf-8')
+        error_content = render_error_page(500, 'Internal Server Error', 'Внутренняя ошибка сервера',
+                                          'Произошла ошибка при обработке запроса.')
         return create_http_response(500, 'text/html', error_content)
 
 def main():
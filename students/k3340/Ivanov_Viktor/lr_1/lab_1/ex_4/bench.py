@@ -0,0 +1,343 @@
+import argparse
+import asyncio
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+import timeit
+import unicodedata
+
+from protocol import (COMPRESSION, PONG_FRAME, RECV_SIZE, FrameDecoder, FrameDecompressor, clean_name,
+                      clean_unicode, decode_frame, encode_frame, is_compressed_stream)
+
+# параметры нагрузочного теста
+HOST = 'localhost'
+PORT = 9083  # порт сервера, запускаемого тестом (не мешает серверу на 8083)
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+PERCENTILES = (0.5, 0.99, 0.999)
+# слова для текста сообщений: заполнение из одних 'x' сжималось бы нереалистично хорошо
+WORDS = ('привет', 'как', 'дела', 'сегодня', 'завтра', 'лабораторная', 'сервер', 'клиент', 'работает',
+         'hello', 'ok', 'thanks', 'see', 'you', 'later', 'commit', 'review', 'deploy', '42', ':)')
+
+class BenchStats:
+    """Результаты одного прогона: задержки доставки и счетчики"""
+    def __init__(self):
+        self.latencies = []  # задержки доставки, нс (по одной на каждого получателя)
+        self.sent = 0
+        self.delivered = 0
+        self.bytes_received = 0
+        self.errors = 0
+        self.compressed = 0  # число клиентов, которым сервер сжимает поток
+        self.rss_peak = 0  # пиковый RSS сервера, КБ
+
+    def percentile(self, fraction):
+        """Перцентиль задержки в миллисекундах (метод ближайшего ранга)"""
+        if not self.latencies:
+            return 0.0
+        index = min(len(self.latencies) - 1, int(fraction * len(self.latencies)))
+        return self.latencies[index] / 1e6
+
+class BenchClient:
+    """Неинтерактивный клиент чата для нагрузочного теста
+
+    Каждое сообщение несет метку времени отправки, поэтому получатель
+    сразу считает задержку доставки от отправителя через сервер до себя.
+    """
+    def __init__(self, index, stats, compression=False):
+        self.index = index
+        self.compression = compression
+        self.username = f'bench_{index}'
+        self.stats = stats
+        self.reader = None
+        self.writer = None
+        self.decoder = FrameDecoder()
+        self.measuring = False
+        self.ready = asyncio.Event()
+
+    async def connect(self, host, port, room=None):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        handshake = {'username': self.username}
+        if self.compression:
+            handshake['compression'] = [COMPRESSION]
+        self.writer.write(encode_frame(handshake))
+        if room:
+            self.writer.write(encode_frame({'type': 'join', 'room': room}))
+        await self.writer.drain()
+
+    async def read_loop(self, room):
+        """Чтение кадров: ответы на ping и замер задержек"""
+        decompressor = None
+        first_data = True
+        try:
+            while True:
+                data = await self.reader.read(RECV_SIZE)
+                if not data:
+                    break
+                # считаются байты, пришедшие по сети (до распаковки)
+                if self.measuring:
+                    self.stats.bytes_received += len(data)
+                received = time.perf_counter_ns()
+                if first_data:
+                    first_data = False
+                    if self.compression and is_compressed_stream(data):
+                        decompressor = FrameDecompressor()
+                        self.stats.compressed += 1
+                if decompressor is not None:
+                    data = decompressor.decompress(data)
+
+                for frame in self.decoder.feed(data):
+                    message_data = decode_frame(frame)
+                    message_type = message_data.get('type')
+                    if message_type == 'ping':
+                        self.writer.write(PONG_FRAME)
+                    elif message_type == 'room_joined' and message_data.get('room') == room:
+                        self.ready.set()
+                    elif message_type == 'error':
+                        self.stats.errors += 1
+                    elif message_type in ('message', 'private') and self.measuring:
+                        # текст сообщения: "<метка отправки, нс>|<заполнение>"
+                        stamp = message_data.get('message', '').split('|', 1)[0]
+                        if stamp.isdigit():
+                            self.stats.latencies.append(received - int(stamp))
+                            self.stats.delivered += 1
+        except (ConnectionError, OSError):
+            pass
+
+    async def send_loop(self, rate, duration, dm_ratio, peers, paddings):
+        """Отправка с постоянной частотой по расписанию (открытая модель нагрузки)
+
+        Время следующей отправки не зависит от скорости ответа сервера,
+        поэтому перегрузка видна в задержках, а не прячется за паузами клиента.
+        """
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / rate
+        start = loop.time() + random.random() * interval
+        deadline = start + duration
+        sent = 0
+
+        while True:
+            next_send = start + sent * interval
+            if next_send >= deadline:
+                break
+            delay = next_send - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            text = f'{time.perf_counter_ns()}|{random.choice(paddings)}'
+            if peers and random.random() < dm_ratio:
+                message_data = {'type': 'private', 'target_username': random.choice(peers), 'message': text}
+            else:
+                message_data = {'type': 'message', 'message': text}
+            self.writer.write(encode_frame(message_data))
+            sent += 1
+            self.stats.sent += 1
+            if self.writer.transport.get_write_buffer_size() > 1024 * 1024:
+                await self.writer.drain()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+def process_rss(pid):
+    """Суммарный RSS процесса и его потомков в КБ (по /proc, только Linux)"""
+    total = 0
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    total += int(line.split()[1])
+                    break
+        with open(f'/proc/{pid}/task/{pid}/children') as children:
+            for child in children.read().split():
+                total += process_rss(int(child))
+    except (OSError, ValueError):
+        pass
+    return total
+
+async def watch_rss(pid, stats):
+    while True:
+        stats.rss_peak = max(stats.rss_peak, process_rss(pid))
+        await asyncio.sleep(0.5)
+
+def make_paddings(size, count=256):
+    """Набор текстов сообщений примерно заданного размера из случайных слов"""
+    paddings = []
+    for _ in range(count):
+        words = []
+        while sum(len(word) + 1 for word in words) < size:
+            words.append(random.choice(WORDS))
+        paddings.append(' '.join(words))
+    return paddings
+
+async def run_load(args, compression=False, server_pid=None):
+    """Один прогон: подключение клиентов, нагрузка, сбор задержек"""
+    stats = BenchStats()
+    clients = [BenchClient(index, stats, compression) for index in range(args.clients)]
+    usernames = [client.username for client in clients]
+    paddings = make_paddings(max(0, args.size - 20))
+
+    readers = []
+    for client in clients:
+        room = f'bench_{client.index % args.rooms}' if args.rooms > 1 else 'general'
+        await client.connect(args.host, args.port, room if args.rooms > 1 else None)
+        readers.append(asyncio.ensure_future(client.read_loop(room)))
+    await asyncio.wait_for(asyncio.gather(*(client.ready.wait() for client in clients)), 30)
+
+    rss_task = asyncio.ensure_future(watch_rss(server_pid, stats)) if server_pid else None
+    for client in clients:
+        client.measuring = True
+    started = time.perf_counter()
+    await asyncio.gather(*(client.send_loop(args.rate, args.duration, args.dm_ratio,
+                                            [name for name in usernames if name != client.username],
+                                            paddings)
+                           for client in clients))
+    # ждем доставки сообщений, отправленных в конце прогона
+    await asyncio.sleep(args.drain)
+    elapsed = time.perf_counter() - started
+
+    for client in clients:
+        client.measuring = False
+        client.close()
+    for task in readers + ([rss_task] if rss_task else []):
+        task.cancel()
+    await asyncio.gather(*readers, *([rss_task] if rss_task else []), return_exceptions=True)
+
+    stats.latencies.sort()
+    return stats, elapsed
+
+def start_server(args, mode):
+    """Запуск локального сервера в отдельном процессе, ожидание открытия порта"""
+    command = [sys.executable, SERVER_SCRIPT, '--mode', mode, '--host', args.host,
+               '--port', str(args.port), '--workers', str(args.workers)] + args.server_args
+    if '--rate-limit' not in args.server_args:
+        # тест сам задает частоту; лимиты сервера проверяются только если заданы явно
+        command.append('--no-rate-limit')
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((args.host, args.port), timeout=0.2).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    stop_server(process)
+    raise RuntimeError(f"Сервер ({mode}) не запустился на {args.host}:{args.port}")
+
+def stop_server(process):
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def print_report(label, args, stats, elapsed):
+    print(f"\n=== {label}: клиентов {args.clients}, {args.rate} сообщ./с на клиента, "
+          f"личных {args.dm_ratio:.0%}, комнат {args.rooms}, {args.duration} с ===")
+    print(f"Отправлено:      {stats.sent} ({stats.sent / args.duration:.0f} сообщ./с)")
+    print(f"Доставлено:      {stats.delivered} ({stats.delivered / elapsed:.0f} доставок/с)")
+    print(f"Получено байт:   {stats.bytes_received} ({stats.bytes_received / max(stats.delivered, 1):.0f} на доставку)")
+    print("Задержка, мс:    " + '  '.join(f"p{fraction * 100:g}={stats.percentile(fraction):.2f}"
+                                         for fraction in PERCENTILES)
+          + f"  max={stats.latencies[-1] / 1e6 if stats.latencies else 0:.2f}")
+    if stats.rss_peak:
+        print(f"RSS сервера:     {stats.rss_peak / 1024:.1f} МБ (пик)")
+    if stats.compressed:
+        print(f"Сжатие потока:   {stats.compressed} из {args.clients} клиентов")
+    if stats.errors:
+        print(f"Ошибок от сервера: {stats.errors}")
+
+def bench_load(args):
+    """Нагрузочный тест: для каждого режима и варианта сжатия свой сервер и свой прогон"""
+    for compression in args.compression:
+        compressed = compression == COMPRESSION
+        if args.external:
+            stats, elapsed = asyncio.run(run_load(args, compressed))
+            print_report(f"{args.host}:{args.port}, сжатие {compression}", args, stats, elapsed)
+            continue
+
+        for mode in args.mode:
+            process = start_server(args, mode)
+            try:
+                stats, elapsed = asyncio.run(run_load(args, compressed, process.pid))
+            finally:
+                stop_server(process)
+            label = mode if args.workers == 1 else f'{mode} x{args.workers}'
+            print_report(f"{label}, сжатие {compression}", args, stats, elapsed)
+
+# входные данные микротеста очистки Unicode: {название: текст}
+UNICODE_SAMPLES = {
+    'ASCII-сообщение': 'Hello everyone, the lab server is up again :) see you at 18:00',
+    'кириллица': 'Привет всем! Сервер лабораторной снова работает, встречаемся в 18:00',
+    'нужна NFKC': 'Ｈｅｌｌｏ ﬁnal ①②③ café',
+    'с суррогатом': 'Привет \ud800 мир',
+    'имя (ASCII)': 'alice',
+    'имя (кириллица)': 'Виктор',
+}
+
+def legacy_clean_unicode(text):
+    """Прежняя очистка: генератор по каждому символу и безусловная NFKC"""
+    if not isinstance(text, str):
+        return text
+    cleaned = ''.join(char for char in text if not (0xD800 <= ord(char) <= 0xDFFF))
+    try:
+        cleaned = unicodedata.normalize('NFKC', cleaned)
+    except:
+        pass
+    return cleaned
+
+def bench_unicode(args):
+    """Микротест: стоимость очистки одного текста, нс на вызов"""
+    functions = (('прежняя', legacy_clean_unicode), ('clean_unicode', clean_unicode), ('clean_name', clean_name))
+    print(f"{'вход':<18}" + ''.join(f"{name:>16}" for name, _ in functions))
+    for label, text in UNICODE_SAMPLES.items():
+        assert clean_unicode(text) == legacy_clean_unicode(text) == clean_name(text)
+        row = f"{label:<18}"
+        for _, function in functions:
+            seconds = min(timeit.repeat(lambda: function(text), number=args.number, repeat=5))
+            row += f"{seconds / args.number * 1e9:>13.0f} нс"
+        print(row)
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description="Нагрузочные тесты чата")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    load = commands.add_parser('load', help="N клиентов, задержка доставки и пропускная способность")
+    load.add_argument('--host', default=HOST, help="адрес сервера")
+    load.add_argument('--port', type=int, default=PORT, help="порт сервера")
+    load.add_argument('--external', action='store_true',
+                      help="не запускать сервер, подключаться к уже запущенному")
+    load.add_argument('--mode', nargs='+', choices=('threads', 'async'), default=['threads'],
+                      help="режимы сервера для сравнения (каждый в отдельном прогоне)")
+    load.add_argument('--workers', type=int, default=1, help="число рабочих процессов сервера")
+    load.add_argument('--clients', type=int, default=50, help="число клиентов")
+    load.add_argument('--rate', type=float, default=2.0, help="сообщений в секунду от каждого клиента")
+    load.add_argument('--duration', type=float, default=10.0, help="длительность нагрузки, секунд")
+    load.add_argument('--drain', type=float, default=2.0, help="ожидание доставки после нагрузки, секунд")
+    load.add_argument('--dm-ratio', type=float, default=0.0, help="доля личных сообщений (0..1)")
+    load.add_argument('--rooms', type=int, default=1, help="число комнат, по которым распределяются клиенты")
+    load.add_argument('--size', type=int, default=64, help="примерный размер текста сообщения, байт")
+    load.add_argument('--compression', nargs='+', choices=('off', COMPRESSION), default=['off'],
+                      help="сжатие потока от сервера; 'off zlib' - сравнить объем трафика")
+    load.add_argument('server_args', nargs=argparse.REMAINDER,
+                      help="дополнительные параметры server.py (после --)")
+    load.set_defaults(handler=bench_load)
+
+    unicode_parser = commands.add_parser('unicode', help="микротест очистки Unicode (clean_unicode)")
+    unicode_parser.add_argument('--number', type=int, default=100000, help="вызовов в одном замере")
+    unicode_parser.set_defaults(handler=bench_unicode)
+
+    args = parser.parse_args()
+    if getattr(args, 'server_args', None) and args.server_args[0] == '--':
+        args.server_args = args.server_args[1:]
+    args.handler(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,38 @@
+import random
 import socket
 import threading
 import json
 import time
-import unicodedata
 from datetime import datetime
 
+from protocol import (COMPRESSION, PONG_FRAME, RECV_SIZE, FrameDecoder, FrameDecompressor, FrameTooLargeError,
+                      clean_name, clean_unicode, decode_frame, encode_frame, is_compressed_stream)
+
 # параметры сервера
 HOST = 'localhost'
 PORT = 8083
+RECONNECT_DELAY = 0.5  # начальная задержка переподключения, удваивается после каждой неудачи
+RECONNECT_MAX_DELAY = 30.0  # максимальная задержка между попытками
+RECONNECT_ATTEMPTS = 10  # попыток подряд, после которых клиент сдается
 
 class ChatClient:
-    def __init__(self, host, port):
+    def __init__(self, host, port, compression=True):
         self.host = host
         self.port = port
+        self.compression = compression  # просить сервер сжимать поток
         self.client_socket = None
         self.username = None
         self.connected = False
         self.receive_thread = None
+        self.room = 'general'  # текущая комната
+        self.history_next_since = None  # метка для запроса следующей страницы истории
+        self.roster = set()  # последний известный список пользователей онлайн
+        self.roster_version = None  # его версия: /users запрашивает только изменения после нее
+        # возобновление сессии после обрыва соединения
+        self.registered = False  # сервер принял имя хотя бы один раз
+        self.resume_token = None
+        self.last_seq = 0  # номер последнего полученного кадра текущего потока
+        self.reconnect_attempts = 0  # неудачных попыток переподключения подряд
         # новые поля для режима сессии
         self.private_session = None  # Имя пользователя для приватной сессии
         self.session_active = False  # Активна ли приватная сессия
@@ -26,36 +42,14 @@ class ChatClient:
         self.waiting_for_session_response = False  # Ожидаем ли ответ на сессию
         self.session_request_from = None  # От кого запрос на сессию
     
-    def clean_unicode(self, text):
-        """Очистка текста от некорректных Unicode-символов"""
-        if not isinstance(text, str):
-            return text
-        
-        # Удаляем суррогатные символы
-        cleaned = ''.join(char for char in text if not (0xD800 <= ord(char) <= 0xDFFF))
-        
-        # Нормализуем Unicode
-        try:
-            cleaned = unicodedata.normalize('NFKC', cleaned)
-        except:
-            pass
-        
-        return cleaned
-        
     def connect(self, username):
         """подключение к чат-серверу"""
         try:
-            # создаем TCP сокет
-            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            
-            # подключаемся к серверу
-            self.client_socket.connect((self.host, self.port))
-            
             # отправляем имя пользователя
             username_data = {
                 'username': username
             }
-            self.client_socket.sendall(json.dumps(username_data).encode('utf-8'))
+            self.open_connection(username_data)
             
             self.username = username
             self.connected = True
@@ -67,6 +61,10 @@ class ChatClient:
             print("   /session username - начать приватную сессию")
             print("   /exit - выйти из приватной сессии")
             print("   /private username message - разовое приватное сообщение")
+            print("   /join room - перейти в комнату")
+            print("   /leave - вернуться в общую комнату")
+            print("   /rooms - список комнат")
+            print("   /history [next] - история комнаты (next - следующая страница)")
             print("   /quit - выход из чата")
             print(f"\nРежим: Общий чат")
             print("-" * 50)
@@ -82,11 +80,64 @@ class ChatClient:
             print(f"Ошибка подключения: {e}")
             return False
     
+    def open_connection(self, handshake):
+        """Новое TCP-соединение с сервером и отправка приветствия"""
+        # создаем TCP сокет
+        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        
+        # подключаемся к серверу
+        client_socket.connect((self.host, self.port))
+        
+        if self.compression:
+            handshake['compression'] = [COMPRESSION]
+        client_socket.sendall(encode_frame(handshake))
+        
+        self.client_socket = client_socket
+        self.last_seq = 0  # кадры каждого соединения нумеруются заново
+    
+    def reconnect(self):
+        """Переподключение после обрыва с экспоненциальной задержкой
+        
+        Если сервер еще помнит сессию, он продолжает ее: комната и присутствие
+        не меняются, а кадры после last_seq приходят повторно.
+        """
+        if not self.registered:
+            return False
+        
+        while self.reconnect_attempts < RECONNECT_ATTEMPTS:
+            self.reconnect_attempts += 1
+            # случайная доля задержки разводит одновременно переподключающихся клиентов
+            delay = min(RECONNECT_MAX_DELAY, RECONNECT_DELAY * 2 ** (self.reconnect_attempts - 1))
+            print(f"\nПереподключение через {delay:.1f} с (попытка {self.reconnect_attempts})...")
+            time.sleep(random.uniform(delay / 2, delay))
+            if not self.connected:
+                return False
+            
+            handshake = {'username': self.username}
+            if self.resume_token:
+                handshake['resume'] = self.resume_token
+                handshake['last_seq'] = self.last_seq
+            try:
+                self.open_connection(handshake)
+                return True
+            except socket.error as e:
+                print(f"Не удалось подключиться: {e}")
+        
+        print("Не удалось переподключиться к серверу")
+        return False
+    
     def disconnect(self):
         """Отключение от сервера"""
+        was_connected = self.connected
         self.connected = False
         
         if self.client_socket:
+            # явный выход: сервер не будет держать сессию для переподключения
+            if was_connected:
+                try:
+                    self.client_socket.sendall(encode_frame({'type': 'quit'}))
+                except:
+                    pass
             try:
                 self.client_socket.close()
             except:
@@ -96,20 +147,54 @@ class ChatClient:
         print("Отключено от сервера")
     
     def receive_messages(self):
-        """Получение сообщений от сервера в отдельном потоке"""
+        """Получение сообщений от сервера в отдельном потоке, с переподключением при обрыве"""
+        while self.connected:
+            self.read_connection()
+            if not self.connected or not self.reconnect():
+                break
+        
+        self.connected = False
+    
+    def read_connection(self):
+        """Чтение кадров из текущего соединения до его обрыва"""
+        decoder = FrameDecoder()
+        decompressor = None
+        first_data = True
+        
         while self.connected:
             try:
-                data = self.client_socket.recv(1024).decode('utf-8')
+                data = self.client_socket.recv(RECV_SIZE)
                 if not data:
                     break
                 
-                # парсим сообщение
-                try:
-                    message_data = json.loads(data)
-                    self.display_message(message_data)
-                except json.JSONDecodeError:
-                    print(f"Ошибка парсинга сообщения: {data}")
+                # сервер согласился на сжатие, если поток начинается не с кадра JSON
+                if first_data:
+                    first_data = False
+                    if self.compression and is_compressed_stream(data):
+                        decompressor = FrameDecompressor()
+                if decompressor is not None:
+                    data = decompressor.decompress(data)
+                
+                # парсим сообщения: за один recv может прийти несколько кадров
+                for frame in decoder.feed(data):
+                    try:
+                        message_data = decode_frame(frame)
+                        # кадр resumed не нумеруется: он сообщает, после какого кадра идет повтор
+                        if message_data.get('type') == 'resumed':
+                            self.last_seq = message_data.get('seq', 0)
+                        else:
+                            self.last_seq += 1
+                        if message_data.get('type') == 'ping':
+                            # проверка активности от сервера
+                            self.client_socket.sendall(PONG_FRAME)
+                        elif message_data.get('type') != 'pong':
+                            self.display_message(message_data)
+                    except (json.JSONDecodeError, UnicodeDecodeError):
+                        print(f"Ошибка парсинга сообщения: {frame!r}")
                     
+            except FrameTooLargeError as e:
+                print(f"Ошибка получения сообщения: {e}")
+                break
             except socket.error:
                 if self.connected:
                     print("Соединение с сервером потеряно")
@@ -118,8 +203,6 @@ class ChatClient:
                 if self.connected:
                     print(f"Ошибка получения сообщения: {e}")
                 break
-        
-        self.connected = False
     
     def display_message(self, message_data):
         """Отображение полученного сообщения"""
@@ -146,20 +229,64 @@ class ChatClient:
         elif message_type == 'system':
             message = message_data.get('message', '')
             online_users = message_data.get('online_users', 0)
+            self.room = message_data.get('room', self.room)
+            self.registered = True
+            self.resume_token = message_data.get('resume_token')
+            self.reconnect_attempts = 0
             print(f"\n[{time_str}] {message} (Онлайн: {online_users})")
             
-        elif message_type == 'user_joined':
-            username = message_data.get('username', 'Unknown')
+        elif message_type == 'resumed':
+            self.room = message_data.get('room', self.room)
+            self.reconnect_attempts = 0
+            print(f"\nСоединение восстановлено, комната {self.room}")
+            if not message_data.get('complete', True):
+                print("Часть сообщений за время обрыва потеряна")
+            
+        elif message_type == 'presence_delta':
+            # вход и выход участников комнаты за короткое окно одним кадром
+            joined = [name for name in message_data.get('joined', []) if name != self.username]
+            left = message_data.get('left', [])
             online_users = message_data.get('online_users', 0)
-            print(f"\n[{time_str}] {username} присоединился к чату (Онлайн: {online_users})")
+            if joined:
+                print(f"\n[{time_str}] {', '.join(joined)}: вход в комнату {message_data.get('room', self.room)} (Онлайн: {online_users})")
+            if left:
+                print(f"\n[{time_str}] {', '.join(left)}: выход из комнаты {message_data.get('room', self.room)} (Онлайн: {online_users})")
             
-        elif message_type == 'user_left':
-            username = message_data.get('username', 'Unknown')
+        elif message_type == 'room_joined':
+            self.room = message_data.get('room', self.room)
             online_users = message_data.get('online_users', 0)
-            print(f"\n[{time_str}] {username} покинул чат (Онлайн: {online_users})")
+            self.history_next_since = None
+            print(f"\n[{time_str}] Вы в комнате {self.room} (Онлайн: {online_users})")
+            history = message_data.get('history', 0)
+            if history:
+                print(f"Последние сообщения комнаты ({history}):")
+            
+        elif message_type == 'history_end':
+            count = message_data.get('count', 0)
+            self.history_next_since = message_data.get('next_since')
+            print(f"\n[{time_str}] История комнаты {message_data.get('room', self.room)}: {count} сообщений")
+            if message_data.get('has_more'):
+                print("Есть еще сообщения: /history next")
+            
+        elif message_type == 'rooms_list':
+            rooms = message_data.get('rooms', [])
+            print(f"\n[{time_str}] Комнаты:")
+            for room in rooms:
+                marker = ' *' if room.get('name') == self.room else ''
+                print(f"    {room.get('name')} ({room.get('users', 0)}){marker}")
             
-        elif message_type == 'users_list':
-            users = message_data.get('users', [])
+        elif message_type in ('users_list', 'users_delta'):
+            if message_type == 'users_delta':
+                # изменения после известной версии списка
+                self.roster.difference_update(message_data.get('left', []))
+                self.roster.update(message_data.get('joined', []))
+                users = sorted(self.roster)
+            else:
+                users = message_data.get('users', [])
+                if 'room' not in message_data:
+                    self.roster = set(users)
+            if 'version' in message_data:
+                self.roster_version = message_data['version']
             print(f"\n[{time_str}] Список пользователей онлайн:")
             for i, user in enumerate(users, 1):
                 print(f"    {i}. {user}")
@@ -202,6 +329,13 @@ class ChatClient:
             # остаемся в общем чате
             if self.session_active:
                 self.exit_private_session()
+            
+        elif message_type == 'session_ended':
+            # собеседник вышел из сессии или из чата
+            from_username = message_data.get('from_username', 'Unknown')
+            print(f"\n[{time_str}] {message_data.get('message', '')}")
+            if self.session_active and self.private_session == from_username:
+                self.exit_private_session(notify=False)
     
     def send_message(self, message):
         """Отправка сообщения на сервер"""
@@ -211,12 +345,12 @@ class ChatClient:
         
         try:
             # Очищаем сообщение от некорректных Unicode-символов
-            cleaned_message = self.clean_unicode(message)
+            cleaned_message = clean_unicode(message)
             message_data = {
                 'type': 'message',
                 'message': cleaned_message
             }
-            self.client_socket.sendall(json.dumps(message_data, ensure_ascii=False).encode('utf-8'))
+            self.client_socket.sendall(encode_frame(message_data))
             return True
         except Exception as e:
             print(f"Ошибка отправки сообщения: {e}")
@@ -230,14 +364,14 @@ class ChatClient:
         
         try:
             # Очищаем сообщение от некорректных Unicode-символов
-            cleaned_message = self.clean_unicode(message)
-            cleaned_username = self.clean_unicode(target_username)
+            cleaned_message = clean_unicode(message)
+            cleaned_username = clean_name(target_username)
             message_data = {
                 'type': 'private',
                 'target_username': cleaned_username,
                 'message': cleaned_message
             }
-            self.client_socket.sendall(json.dumps(message_data, ensure_ascii=False).encode('utf-8'))
+            self.client_socket.sendall(encode_frame(message_data))
             print(f"\nПриватное сообщение отправлено пользователю {cleaned_username}")
             return True
         except Exception as e:
@@ -254,12 +388,46 @@ class ChatClient:
             message_data = {
                 'type': 'users'
             }
-            self.client_socket.sendall(json.dumps(message_data).encode('utf-8'))
+            if self.roster_version is not None:
+                message_data['since'] = self.roster_version
+            self.client_socket.sendall(encode_frame(message_data))
             return True
         except Exception as e:
             print(f"Ошибка запроса списка пользователей: {e}")
             return False
     
+    def join_room(self, room_name):
+        """Переход в комнату"""
+        return self.send_command({'type': 'join', 'room': clean_name(room_name)})
+    
+    def leave_room(self):
+        """Возврат в общую комнату"""
+        return self.send_command({'type': 'leave'})
+    
+    def request_history(self, next_page=False):
+        """Запрос страницы истории текущей комнаты"""
+        message_data = {'type': 'history'}
+        if next_page and self.history_next_since:
+            message_data['since'] = self.history_next_since
+        return self.send_command(message_data)
+    
+    def request_rooms_list(self):
+        """Запрос списка комнат"""
+        return self.send_command({'type': 'rooms'})
+    
+    def send_command(self, message_data):
+        """Отправка служебной команды на сервер"""
+        if not self.connected:
+            print("Нет подключения к серверу")
+            return False
+        
+        try:
+            self.client_socket.sendall(encode_frame(message_data))
+            return True
+        except Exception as e:
+            print(f"Ошибка отправки команды: {e}")
+            return False
+    
     def start_private_session(self, target_username):
         """Запрос на приватную сессию с пользователем"""
         if not self.connected:
@@ -267,7 +435,7 @@ class ChatClient:
             return False
         
         # Очищаем имя пользователя
-        cleaned_username = self.clean_unicode(target_username)
+        cleaned_username = clean_name(target_username)
         
         if cleaned_username == self.username:
             print("Нельзя создать сессию с самим собой")
@@ -280,7 +448,7 @@ class ChatClient:
         }
         
         try:
-            self.client_socket.sendall(json.dumps(session_request, ensure_ascii=False).encode('utf-8'))
+            self.client_socket.sendall(encode_frame(session_request))
             print(f"\nЗапрос на приватную сессию с {cleaned_username} отправлен")
             print(f"Ожидание ответа...")
             return True
@@ -288,12 +456,18 @@ class ChatClient:
             print(f"\nОшибка отправки запроса: {e}")
             return False
     
-    def exit_private_session(self):
-        """Выход из приватной сессии"""
+    def exit_private_session(self, notify=True):
+        """Выход из приватной сессии (notify - сообщить серверу)"""
         if not self.session_active:
             print("Приватная сессия не активна")
             return False
         
+        if notify and self.connected:
+            try:
+                self.client_socket.sendall(encode_frame({'type': 'session_end'}))
+            except:
+                pass
+        
         print(f"\nВыход из приватной сессии с {self.private_session}")
         self.private_session = None
         self.session_active = False
@@ -304,6 +478,8 @@ class ChatClient:
         """Получение текущего промпта для ввода"""
         if self.session_active:
             return f"[Приватно с {self.private_session}] "
+        elif self.room != 'general':
+            return f"[{self.room}] > "
         else:
             return "> "
     
@@ -357,6 +533,23 @@ def main():
                         print("Формат: /session username")
                     continue
                     
+                elif message.startswith('/join '):
+                    # формат: /join room
+                    chat_client.join_room(message.split(' ', 1)[1].strip())
+                    continue
+                    
+                elif message == '/leave':
+                    chat_client.leave_room()
+                    continue
+                    
+                elif message == '/rooms':
+                    chat_client.request_rooms_list()
+                    continue
+                    
+                elif message in ('/history', '/history next'):
+                    chat_client.request_history(next_page=message.endswith('next'))
+                    continue
+                    
                 elif message == '/exit':
                     chat_client.exit_private_session()
                     continue
@@ -381,11 +574,11 @@ def main():
                     if chat_client.connected:
                         response_data = {
                             'type': 'session_response',
-                            'target_username': chat_client.clean_unicode(chat_client.session_request_from),
+                            'target_username': clean_name(chat_client.session_request_from),
                             'accepted': accepted
                         }
                         try:
-                            chat_client.client_socket.sendall(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
+                            chat_client.client_socket.sendall(encode_frame(response_data))
                         except:
                             pass
                     
@@ -406,11 +599,11 @@ def main():
                 # отправка сообщения (обычного или приватного в зависимости от режима)
                 if chat_client.session_active:
                     # в приватной сессии - отправляем приватное сообщение
-                    if not chat_client.send_private_message(chat_client.private_session, message):
+                    if not chat_client.send_private_message(chat_client.private_session, message) and not chat_client.connected:
                         break
                 else:
                     # в обычном режиме - отправляем общее сообщение
-                    if not chat_client.send_message(message):
+                    if not chat_client.send_message(message) and not chat_client.connected:
                         break
                     
             except KeyboardInterrupt:
@@ -0,0 +1,322 @@
+import asyncio
+import concurrent.futures
+import itertools
+import os
+import socket
+import struct
+import threading
+
+from protocol import dumps, loads
+
+# Сообщение шины: заголовок (длина метаданных, длина кадра), метаданные JSON и готовый кадр чата.
+# Кадр передается как есть, без повторной сериализации.
+HEADER = struct.Struct('!II')
+CLAIM_TIMEOUT = 2.0  # секунд ожидания ответа шины на резервирование имени
+
+def pack_message(meta, payload=b''):
+    """Упаковка сообщения шины"""
+    meta_bytes = dumps(meta)
+    return HEADER.pack(len(meta_bytes), len(payload)) + meta_bytes + payload
+
+def recv_exact(sock, size):
+    """Чтение ровно size байт, None при закрытии соединения"""
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+def read_message(sock):
+    """Чтение одного сообщения шины, возвращает (meta, payload) или None"""
+    header = recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    meta_size, payload_size = HEADER.unpack(header)
+    body = recv_exact(sock, meta_size + payload_size)
+    if body is None:
+        return None
+    return loads(body[:meta_size]), body[meta_size:]
+
+class MessageBus:
+    """Локальная шина между рабочими процессами чата
+
+    Работает в родительском процессе на Unix domain socket: каждое сообщение
+    от одного рабочего процесса пересылается всем остальным. Шина также хранит
+    общий список пользователей, чтобы новый рабочий процесс получил его при подключении.
+    Через шину проходят все сообщения комнат, поэтому журнал на диске (chat_log) ведет она.
+    """
+    def __init__(self, path, chat_log=None):
+        self.path = path
+        self.chat_log = chat_log
+        self.server_socket = None
+        self.workers = []  # сокеты подключенных рабочих процессов
+        self.roster = {}  # {username: worker_id}
+        self.lock = threading.Lock()
+        self.running = False
+
+    def start(self):
+        """Запуск шины в фоновом потоке"""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server_socket.bind(self.path)
+        self.server_socket.listen(128)
+        self.running = True
+
+        accept_thread = threading.Thread(target=self.accept_loop)
+        accept_thread.daemon = True
+        accept_thread.start()
+
+    def stop(self):
+        """Остановка шины"""
+        self.running = False
+        with self.lock:
+            for worker in self.workers:
+                try:
+                    worker.close()
+                except:
+                    pass
+            self.workers.clear()
+        if self.server_socket:
+            try:
+                self.server_socket.close()
+            except:
+                pass
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        if self.chat_log is not None:
+            self.chat_log.close()
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                worker, _ = self.server_socket.accept()
+            except OSError:
+                break
+            worker_thread = threading.Thread(target=self.handle_worker, args=(worker,))
+            worker_thread.daemon = True
+            worker_thread.start()
+
+    def relay(self, sender, data):
+        """Пересылка сообщения всем процессам, кроме отправителя (вызывается под self.lock)"""
+        for other in self.workers:
+            if other is not sender:
+                try:
+                    other.sendall(data)
+                except OSError:
+                    pass
+
+    def claim(self, worker, meta):
+        """Резервирование имени (вызывается под self.lock)
+
+        Шина - единственный владелец списка имен: проверка и запись идут под
+        одной блокировкой, поэтому два процесса не могут занять одно имя.
+        """
+        username = meta['username']
+        owner = self.roster.get(username)
+        ok = owner is None or owner == meta['worker']
+        if ok:
+            self.roster[username] = meta['worker']
+            self.relay(worker, pack_message({'op': 'presence', 'username': username,
+                                             'online': True, 'worker': meta['worker']}))
+        worker.sendall(pack_message({'op': 'claimed', 'id': meta['id'], 'ok': ok}))
+
+    def handle_worker(self, worker):
+        """Прием сообщений от рабочего процесса и пересылка остальным"""
+        with self.lock:
+            # снимок списка и регистрация под одной блокировкой: изменения не потеряются
+            worker.sendall(pack_message({'op': 'roster', 'users': self.roster}))
+            self.workers.append(worker)
+
+        worker_id = None
+        try:
+            while self.running:
+                message = read_message(worker)
+                if message is None:
+                    break
+                meta, payload = message
+                worker_id = meta.get('worker', worker_id)
+
+                if self.chat_log is not None and meta.get('op') == 'room' and meta.get('timestamp'):
+                    self.chat_log.append(meta['room'], payload)
+
+                with self.lock:
+                    if meta.get('op') == 'claim':
+                        self.claim(worker, meta)
+                        continue
+                    if meta.get('op') == 'presence':
+                        if meta['online']:
+                            # имя, занятое другим процессом, не переходит к последнему приславшему
+                            if self.roster.setdefault(meta['username'], meta['worker']) != meta['worker']:
+                                continue
+                        elif self.roster.get(meta['username']) == meta['worker']:
+                            del self.roster[meta['username']]
+
+                    self.relay(worker, pack_message(meta, payload))
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                if worker in self.workers:
+                    self.workers.remove(worker)
+                # пользователи завершившегося процесса больше не в сети
+                for username, owner in list(self.roster.items()):
+                    if owner == worker_id:
+                        del self.roster[username]
+                        self.relay(worker, pack_message({'op': 'presence', 'username': username,
+                                                         'online': False, 'worker': worker_id}))
+            try:
+                worker.close()
+            except:
+                pass
+
+class BusClient:
+    """Подключение рабочего процесса к шине
+
+    Резервирует имена через шину, публикует рассылки в комнаты, личные сообщения
+    и изменения присутствия, а входящие сообщения передает серверу через
+    server.run_in_server.
+    """
+    def __init__(self, path, server):
+        self.server = server
+        self.worker_id = os.getpid()
+        self.remote_users = {}  # пользователи других процессов {username: worker_id}
+        self.users_lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.claims = {}  # ожидающие ответа шины резервирования {номер: Future}
+        self.claim_ids = itertools.count(1)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+
+        self.reader_thread = threading.Thread(target=self.read_loop)
+        self.reader_thread.daemon = True
+        self.reader_thread.start()
+
+    def publish(self, meta, payload=b''):
+        meta['worker'] = self.worker_id
+        data = pack_message(meta, payload)
+        with self.send_lock:
+            self.sock.sendall(data)
+
+    def publish_room(self, room_name, frame, timestamp=None):
+        self.publish({'op': 'room', 'room': room_name, 'timestamp': timestamp}, frame)
+
+    def publish_user(self, username, frame):
+        self.publish({'op': 'user', 'username': username}, frame)
+
+    def publish_session_request(self, from_username, username, frame):
+        self.publish({'op': 'session_request', 'username': username, 'from': from_username}, frame)
+
+    def request_claim(self, username):
+        """Запрос резервирования имени, возвращает (номер, Future с ответом шины)
+
+        При успехе шина сама сообщает остальным процессам о входе пользователя.
+        """
+        claim_id = next(self.claim_ids)
+        future = concurrent.futures.Future()
+        self.claims[claim_id] = future
+        self.publish({'op': 'claim', 'username': username, 'id': claim_id})
+        return claim_id, future
+
+    def claim_expired(self, claim_id, username):
+        """Шина не ответила вовремя: она могла занять имя позже, освобождаем его"""
+        self.claims.pop(claim_id, None)
+        self.publish_presence(username, False)
+
+    def claim_user(self, username, timeout=CLAIM_TIMEOUT):
+        """Резервирование имени на шине, True - имя свободно во всех процессах
+
+        Блокирует вызывающий поток до ответа шины.
+        """
+        claim_id, future = self.request_claim(username)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            self.claim_expired(claim_id, username)
+            return False
+
+    async def claim_user_async(self, username, timeout=CLAIM_TIMEOUT):
+        """claim_user для цикла asyncio: ждет только вызывающая сопрограмма
+
+        Future завершает поток чтения шины, в цикл событий результат
+        передается через call_soon_threadsafe (asyncio.wrap_future).
+        """
+        claim_id, future = self.request_claim(username)
+        try:
+            # shield: таймаут не отменяет Future, который завершит поток чтения
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except asyncio.TimeoutError:
+            self.claim_expired(claim_id, username)
+            return False
+
+    def publish_presence(self, username, online):
+        self.publish({'op': 'presence', 'username': username, 'online': online})
+
+    def has_user(self, username):
+        with self.users_lock:
+            return username in self.remote_users
+
+    def remote_usernames(self):
+        with self.users_lock:
+            return list(self.remote_users)
+
+    def read_loop(self):
+        """Обработка сообщений от других рабочих процессов"""
+        try:
+            while True:
+                message = read_message(self.sock)
+                if message is None:
+                    break
+                meta, payload = message
+                op = meta.get('op')
+
+                if op == 'claimed':
+                    future = self.claims.pop(meta['id'], None)
+                    if future is not None:
+                        future.set_result(meta['ok'])
+                elif op == 'roster':
+                    with self.users_lock:
+                        self.remote_users = {username: worker_id for username, worker_id in meta['users'].items()
+                                             if worker_id != self.worker_id}
+                    for username in self.remote_usernames():
+                        self.server.roster.update(username, True)
+                elif op == 'presence':
+                    with self.users_lock:
+                        if meta['online']:
+                            self.remote_users[meta['username']] = meta['worker']
+                            changed = True
+                        else:
+                            changed = self.remote_users.get(meta['username']) == meta['worker']
+                            if changed:
+                                del self.remote_users[meta['username']]
+                    # версия общего списка пользователей учитывает и другие процессы
+                    if changed:
+                        self.server.roster.update(meta['username'], meta['online'])
+                        if not meta['online']:
+                            self.server.run_in_server(self.server.remote_user_left, meta['username'])
+                elif op == 'room':
+                    self.server.run_in_server(self.server.deliver_to_room, meta['room'], payload,
+                                              meta.get('timestamp'))
+                elif op == 'user':
+                    self.server.run_in_server(self.server.send_to_user, meta['username'], payload, False)
+                elif op == 'session_request':
+                    self.server.run_in_server(self.server.deliver_session_request, meta['from'],
+                                              meta['username'], payload)
+        except OSError:
+            pass
+
+        # без шины процесс не видит остальных пользователей (например, родитель завершился)
+        if self.server.running:
+            print("Соединение с шиной сообщений потеряно, рабочий процесс останавливается")
+            self.server.run_in_server(self.server.stop)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except:
+            pass
@@ -0,0 +1,270 @@
+import os
+import queue
+import struct
+import threading
+import time
+from collections import deque
+from urllib.parse import quote
+
+HISTORY_SIZE = 100  # число последних сообщений, которые хранит каждая комната
+HISTORY_PAGE = 50  # максимальное число сообщений в одном ответе на запрос history
+
+LOG_SEGMENT_SIZE = 4 * 1024 * 1024  # размер сегмента журнала, после которого начинается новый
+LOG_MAX_SEGMENTS = 8  # сколько сегментов журнала хранить на комнату
+LOG_FSYNC_INTERVAL = 1.0  # секунд между fsync; 0 - после каждой пачки, < 0 - никогда
+INDEX_RECORD = struct.Struct('!QI')  # запись индекса: смещение кадра в сегменте и его длина
+
+class MessageHistory:
+    """Кольцевой буфер последних сообщений комнаты
+
+    Хранит уже закодированные кадры вместе с их временными метками,
+    поэтому повтор истории - это склейка байтов без повторной сериализации.
+    Размер буфера ограничен: старые сообщения вытесняются новыми.
+    """
+    def __init__(self, size=HISTORY_SIZE):
+        self.entries = deque(maxlen=size)  # [(timestamp, frame)]
+        self.lock = threading.Lock()
+
+    def append(self, timestamp, frame):
+        with self.lock:
+            self.entries.append((timestamp, frame))
+
+    def replay(self):
+        """Вся сохраненная история одним блоком байтов"""
+        with self.lock:
+            return b''.join(frame for _, frame in self.entries)
+
+    def since(self, since=None, limit=HISTORY_PAGE):
+        """Страница истории: сообщения новее since (ISO-строка), не больше limit
+
+        Возвращает (кадры, метка последнего кадра, есть ли еще сообщения).
+        """
+        with self.lock:
+            entries = [entry for entry in self.entries if since is None or entry[0] > since]
+
+        page = entries[:limit]
+        last_timestamp = page[-1][0] if page else since
+        return [frame for _, frame in page], last_timestamp, len(entries) > len(page)
+
+    def __len__(self):
+        return len(self.entries)
+
+class LogSegment:
+    """Открытый для записи сегмент журнала комнаты"""
+    def __init__(self, directory, number):
+        self.number = number
+        self.log_path = os.path.join(directory, f'{number:08d}.log')
+        self.index_path = os.path.join(directory, f'{number:08d}.idx')
+        self.recover()
+        self.log = open(self.log_path, 'ab')
+        self.index = open(self.index_path, 'ab')
+        self.size = self.log.tell()
+
+    def recover(self):
+        """Обрезка недописанного хвоста после аварийного завершения
+
+        Индекс пишется после данных, поэтому верными считаются записи индекса,
+        чьи кадры целиком лежат в сегменте; все, что после них, отбрасывается.
+        """
+        if not os.path.exists(self.index_path):
+            open(self.index_path, 'wb').close()
+        log_size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+
+        with open(self.index_path, 'r+b') as index:
+            records = index.read()
+            count = len(records) // INDEX_RECORD.size
+            end = 0
+            while count:
+                offset, length = INDEX_RECORD.unpack_from(records, (count - 1) * INDEX_RECORD.size)
+                if offset + length <= log_size:
+                    end = offset + length
+                    break
+                count -= 1
+            index.truncate(count * INDEX_RECORD.size)
+
+        with open(self.log_path, 'ab') as log:
+            log.truncate(end)
+
+    def write(self, frame):
+        self.log.write(frame)
+        self.index.write(INDEX_RECORD.pack(self.size, len(frame)))
+        self.size += len(frame)
+
+    def flush(self):
+        # данные раньше индекса: читатель не увидит запись индекса без кадра
+        self.log.flush()
+        self.index.flush()
+
+    def fsync(self):
+        os.fsync(self.log.fileno())
+        os.fsync(self.index.fileno())
+
+    def close(self):
+        self.log.close()
+        self.index.close()
+
+class ChatLog:
+    """Постоянный журнал сообщений комнат
+
+    Для каждой комнаты - каталог с сегментами только для дописывания
+    (NNNNNNNN.log, кадры подряд) и индексами смещений (NNNNNNNN.idx, по записи
+    фиксированного размера на кадр). Запись идет в фоновом потоке пачками и не
+    задерживает рассылку; fsync выполняется не чаще fsync_interval. Последние N
+    сообщений читаются через индекс одним seek, без просмотра файла.
+    """
+    def __init__(self, path, fsync_interval=LOG_FSYNC_INTERVAL,
+                 segment_size=LOG_SEGMENT_SIZE, max_segments=LOG_MAX_SEGMENTS):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.queue = queue.Queue()
+        self.segments = {}  # открытые сегменты {room_name: LogSegment}, только поток записи
+        self.writer_thread = None
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def room_directory(self, room_name):
+        return os.path.join(self.path, 'room-' + quote(room_name, safe=''))
+
+    def segment_numbers(self, directory):
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:-4]) for name in names if name.endswith('.log') and name[:-4].isdigit())
+
+    def append(self, room_name, frame):
+        """Постановка кадра в очередь записи (не блокирует вызывающий поток)"""
+        if self.writer_thread is None:
+            with self.lock:
+                if self.writer_thread is None:
+                    self.writer_thread = threading.Thread(target=self.write_loop)
+                    self.writer_thread.daemon = True
+                    self.writer_thread.start()
+        self.queue.put((room_name, frame))
+
+    def close(self):
+        """Запись оставшихся кадров, fsync и остановка потока записи"""
+        with self.lock:
+            writer_thread = self.writer_thread
+            self.writer_thread = None
+        if writer_thread is not None:
+            self.queue.put(None)
+            writer_thread.join()
+
+    def write_loop(self):
+        """Поток записи: пишет накопившиеся кадры пачкой, fsync - по интервалу"""
+        dirty = set()
+        last_fsync = time.monotonic()
+        timeout = self.fsync_interval if self.fsync_interval > 0 else None
+        stopping = False
+
+        while not stopping:
+            try:
+                batch = [self.queue.get(timeout=timeout)]
+            except queue.Empty:
+                batch = []
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            written = set()  # комнаты, чьи сегменты нужно сбросить после пачки
+            for item in batch:
+                if item is None:
+                    stopping = True
+                    continue
+                room_name, frame = item
+                try:
+                    self.write_frame(room_name, frame)
+                    written.add(room_name)
+                except OSError as e:
+                    print(f"Ошибка записи журнала комнаты {room_name}: {e}")
+
+            # один flush на сегмент за пачку, а не на каждый кадр
+            for room_name in written:
+                try:
+                    self.segments[room_name].flush()
+                except (KeyError, OSError) as e:
+                    print(f"Ошибка записи журнала комнаты {room_name}: {e}")
+            dirty |= written
+
+            now = time.monotonic()
+            if dirty and self.fsync_interval >= 0 and (stopping or now - last_fsync >= self.fsync_interval):
+                for room_name in dirty:
+                    try:
+                        self.segments[room_name].fsync()
+                    except (KeyError, OSError):
+                        pass
+                dirty.clear()
+                last_fsync = now
+
+        for segment in self.segments.values():
+            segment.close()
+        self.segments.clear()
+
+    def write_frame(self, room_name, frame):
+        segment = self.segments.get(room_name)
+        if segment is None:
+            directory = self.room_directory(room_name)
+            os.makedirs(directory, exist_ok=True)
+            numbers = self.segment_numbers(directory)
+            segment = self.segments[room_name] = LogSegment(directory, numbers[-1] if numbers else 1)
+        elif segment.size and segment.size + len(frame) > self.segment_size:
+            segment = self.roll_segment(room_name, segment)
+        segment.write(frame)
+        return segment
+
+    def roll_segment(self, room_name, segment):
+        """Переход к новому сегменту и удаление самых старых"""
+        segment.flush()
+        if self.fsync_interval >= 0:
+            segment.fsync()
+        segment.close()
+
+        directory = self.room_directory(room_name)
+        segment = self.segments[room_name] = LogSegment(directory, segment.number + 1)
+        for number in self.segment_numbers(directory)[:-self.max_segments]:
+            for extension in ('.log', '.idx'):
+                try:
+                    os.unlink(os.path.join(directory, f'{number:08d}{extension}'))
+                except FileNotFoundError:
+                    pass
+        return segment
+
+    def tail(self, room_name, count):
+        """Последние count кадров комнаты в порядке записи
+
+        В каждом сегменте читается только хвост индекса и один непрерывный
+        участок данных. Безопасно вызывать одновременно с записью,
+        в том числе из другого процесса.
+        """
+        directory = self.room_directory(room_name)
+        frames = []
+
+        for number in reversed(self.segment_numbers(directory)):
+            need = count - len(frames)
+            if need <= 0:
+                break
+            try:
+                with open(os.path.join(directory, f'{number:08d}.idx'), 'rb') as index, \
+                     open(os.path.join(directory, f'{number:08d}.log'), 'rb') as log:
+                    records = os.fstat(index.fileno()).st_size // INDEX_RECORD.size
+                    take = min(need, records)
+                    if not take:
+                        continue
+                    index.seek((records - take) * INDEX_RECORD.size)
+                    entries = list(INDEX_RECORD.iter_unpack(index.read(take * INDEX_RECORD.size)))
+                    start = entries[0][0]
+                    log.seek(start)
+                    data = log.read(entries[-1][0] + entries[-1][1] - start)
+            except FileNotFoundError:
+                # сегмент удален при ротации во время чтения
+                break
+            chunk = [data[offset - start:offset - start + length]
+                     for offset, length in entries if offset - start + length <= len(data)]
+            frames = chunk + frames
+
+        return frames
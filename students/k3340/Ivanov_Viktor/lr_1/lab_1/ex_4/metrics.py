@@ -0,0 +1,199 @@
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_HOST = 'localhost'  # порт метрик слушает только локальный интерфейс
+# границы корзин гистограмм: время в секундах и число получателей рассылки
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+FANOUT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+def format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+class Counter:
+    """Счетчик, опционально с одной меткой"""
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.values = {}  # {значение метки: число}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, label_value=''):
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self.lock:
+            values = sorted(self.values.items())
+        if not values and not self.label:
+            values = [('', 0)]
+        for label_value, value in values:
+            labels = f'{{{self.label}="{label_value}"}}' if self.label else ''
+            lines.append(f'{self.name}{labels} {format_value(value)}')
+        return lines
+
+class Gauge:
+    """Текущее значение, которое вычисляется в момент запроса метрик
+
+    Поэтому глубины очередей и размеры списков ничего не стоят, пока метрики
+    никто не читает.
+    """
+    def __init__(self, name, help_text, collect):
+        self.name = name
+        self.help_text = help_text
+        self.collect = collect
+
+    def render(self):
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge',
+                f'{self.name} {format_value(self.collect())}']
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами"""
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина - +Inf
+        self.sum = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self):
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_sum {format_value(total)}')
+        lines.append(f'{self.name}_count {count}')
+        return lines
+
+class TimedLock:
+    """Обертка над блокировкой, измеряющая время ожидания захвата
+
+    Незанятая блокировка захватывается без обращения к часам.
+    """
+    def __init__(self, lock, histogram):
+        self.lock = lock
+        self.histogram = histogram
+
+    def __enter__(self):
+        if self.lock.acquire(False):
+            self.histogram.observe(0)
+            return self
+        start = time.perf_counter()
+        self.lock.acquire()
+        self.histogram.observe(time.perf_counter() - start)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+class Metrics:
+    """Реестр метрик и их вывод в текстовом формате Prometheus"""
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help_text, label=None):
+        return self.register(Counter(name, help_text, label))
+
+    def gauge(self, name, help_text, collect):
+        return self.register(Gauge(name, help_text, collect))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+class ChatMetrics(Metrics):
+    """Метрики чат-сервера, которые обновляются на пути обработки сообщений
+
+    Мгновенные значения (клиенты, очереди, комнаты) сервер регистрирует
+    через gauge() со своими функциями подсчета.
+    """
+    def __init__(self):
+        super().__init__()
+        self.connections = self.counter('chat_connections_total', 'Принятые TCP-подключения')
+        self.resumed = self.counter('chat_sessions_resumed_total', 'Сессии, продолженные после переподключения')
+        self.frames_received = self.counter('chat_frames_received_total', 'Кадры от клиентов', 'type')
+        self.rate_limited = self.counter('chat_frames_rate_limited_total',
+                                         'Кадры, отброшенные ограничением частоты', 'type')
+        self.bytes_received = self.counter('chat_bytes_received_total', 'Байты, прочитанные из сокетов клиентов')
+        self.frames_sent = self.counter('chat_frames_sent_total', 'Кадры, записанные в сокеты клиентов')
+        self.bytes_sent = self.counter('chat_bytes_sent_total',
+                                       'Байты, записанные в сокеты клиентов (после сжатия)')
+        self.broadcast_seconds = self.histogram('chat_broadcast_seconds',
+                                                'Время постановки кадра рассылки в очереди участников комнаты')
+        self.broadcast_recipients = self.histogram('chat_broadcast_recipients',
+                                                   'Число получателей одной рассылки', FANOUT_BUCKETS)
+        self.clients_lock_wait = self.histogram('chat_clients_lock_wait_seconds',
+                                                'Ожидание захвата clients_lock')
+
+    def record_sent(self, frames, size):
+        self.frames_sent.inc(frames)
+        self.bytes_sent.inc(size)
+
+class MetricsServer:
+    """HTTP-порт администрирования: GET /metrics отдает метрики в формате Prometheus
+
+    Работает в отдельном потоке и в многопоточном, и в asyncio-режиме сервера.
+    """
+    def __init__(self, metrics, port, host=METRICS_HOST):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.httpd = None
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer((self.host, self.port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.metrics = self.metrics
+        server_thread = threading.Thread(target=self.httpd.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # запросы метрик не засоряют вывод сервера
+        pass
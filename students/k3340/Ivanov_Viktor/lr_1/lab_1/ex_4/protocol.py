@@ -0,0 +1,178 @@
+import json
+import unicodedata
+import zlib
+from datetime import datetime
+from functools import lru_cache
+
+# orjson (если установлен) сериализует в несколько раз быстрее стандартного json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Протокол чата: каждое сообщение - одна строка JSON, завершенная символом '\n'.
+# json.dumps экранирует переводы строк внутри значений, поэтому разделитель
+# никогда не встречается внутри сообщения.
+DELIMITER = b'\n'
+RECV_SIZE = 65536           # размер буфера одного вызова recv
+MAX_FRAME_SIZE = 64 * 1024  # максимальный размер одного сообщения в байтах
+NAME_CACHE_SIZE = 4096  # число запоминаемых очищенных имен пользователей и комнат
+
+class FrameTooLargeError(ValueError):
+    """Сообщение превышает допустимый размер кадра"""
+
+if orjson is not None:
+    JSON_BACKEND = 'orjson'
+
+    def dumps(message_data):
+        """Сериализация сообщения в байты UTF-8"""
+        return orjson.dumps(message_data)
+
+    loads = orjson.loads
+else:
+    JSON_BACKEND = 'json'
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(message_data):
+        """Сериализация сообщения в байты UTF-8"""
+        return _encoder.encode(message_data).encode('utf-8')
+
+    loads = json.loads
+
+def clean_unicode(text):
+    """Очистка текста: удаление одиночных суррогатов и нормализация NFKC
+
+    Большинство сообщений не требует изменений, поэтому сначала проверяются
+    быстрые случаи: ASCII-строка уже нормализована и не содержит суррогатов,
+    а уже нормализованная строка возвращается без копирования.
+    """
+    if not isinstance(text, str) or text.isascii():
+        return text
+
+    # суррогаты не кодируются в UTF-8: одна проверка на всю строку вместо цикла по символам
+    try:
+        text.encode('utf-8')
+    except UnicodeEncodeError:
+        text = text.encode('utf-8', 'ignore').decode('utf-8')
+
+    if unicodedata.is_normalized('NFKC', text):
+        return text
+    return unicodedata.normalize('NFKC', text)
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def clean_cached(text):
+    return clean_unicode(text)
+
+def clean_name(text):
+    """clean_unicode для имен пользователей и комнат: одни и те же имена приходят
+    постоянно, поэтому результат запоминается"""
+    if not isinstance(text, str) or text.isascii():
+        return text
+    return clean_cached(text)
+
+def encode_frame(message_data):
+    """Кодирование сообщения в кадр для отправки"""
+    return dumps(message_data) + DELIMITER
+
+# проверка активности соединения: ping от одной стороны, pong в ответ
+PING_FRAME = encode_frame({'type': 'ping'})
+PONG_FRAME = encode_frame({'type': 'pong'})
+
+def encode_event(message_type, timestamp=None, **fields):
+    """Кадр события сервера: тип, поля и временная метка
+
+    Кадр кодируется один раз и затем без копирования ставится
+    в очереди всех получателей.
+    """
+    message_data = {'type': message_type}
+    message_data.update(fields)
+    message_data['timestamp'] = timestamp or datetime.now().isoformat()
+    return encode_frame(message_data)
+
+def decode_frame(frame):
+    """Разбор кадра в словарь сообщения"""
+    return loads(frame)
+
+# Сжатие потока от сервера к клиенту. Клиент просит его в приветствии
+# ({"username": ..., "compression": ["zlib"]}); если сервер согласен, все байты
+# от сервера, начиная с первого, идут одним потоком zlib. Клиент узнает это
+# по первому байту: кадр JSON начинается с '{', поток zlib - нет.
+COMPRESSION = 'zlib'
+COMPRESSION_LEVEL = 6
+COMPRESSION_WBITS = 12  # окно 4 КБ: кадры чата короткие, а память на соединение мала
+COMPRESSION_MEMLEVEL = 5
+# общий словарь: ключи и значения, которые повторяются в кадрах (частые - в конце)
+COMPRESSION_DICTIONARY = (
+    '{"type":"session_request","from_username":"","message":" хочет начать приватную сессию с вами",'
+    '{"type":"users_list","users":[""],"room":"",'
+    '{"type":"rooms_list","rooms":[{"name":"general","users":'
+    '{"type":"history_end","count":,"next_since":"","has_more":false,'
+    '{"type":"room_joined","history":'
+    '{"type":"ping"}\n{"type":"pong"}\n'
+    '{"type":"error","message":"'
+    '{"type":"private","from_username":"'
+    '{"type":"user_left","username":"","message":" покинул чат","online_users":,"room":"general",'
+    '{"type":"user_joined","username":"","message":" присоединился к чату","online_users":'
+    ',"room":"general","timestamp":"20"}\n'
+    '{"type":"message","username":"","message":"","room":"general","timestamp":"20'
+).encode('utf-8')
+
+class FrameCompressor:
+    """Сжатие исходящего потока одного соединения
+
+    Каждая пачка кадров завершается Z_SYNC_FLUSH: получатель может разобрать
+    ее сразу, а контекст сжатия (и словарь) сохраняется между пачками.
+    """
+    def __init__(self):
+        self.compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, COMPRESSION_WBITS,
+                                           COMPRESSION_MEMLEVEL, zlib.Z_DEFAULT_STRATEGY,
+                                           COMPRESSION_DICTIONARY)
+
+    def compress(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+class FrameDecompressor:
+    """Распаковка входящего потока zlib с общим словарем"""
+    def __init__(self):
+        self.decompressor = zlib.decompressobj(COMPRESSION_WBITS, COMPRESSION_DICTIONARY)
+
+    def decompress(self, data):
+        return self.decompressor.decompress(data)
+
+def is_compressed_stream(data):
+    """Начинается ли поток от сервера со сжатых данных, а не с кадра JSON"""
+    return data[:1] != b'{'
+
+class FrameDecoder:
+    """Буфер сборки кадров для одного соединения
+
+    Принимает произвольные куски потока TCP и возвращает полные кадры:
+    один recv может содержать несколько сообщений, а одно сообщение
+    может прийти за несколько recv.
+    """
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.max_frame_size = max_frame_size
+
+    def feed(self, data):
+        """Добавление полученных байтов, возвращает список полных кадров"""
+        self.buffer += data
+        frames = []
+        start = 0
+
+        while True:
+            end = self.buffer.find(DELIMITER, start)
+            if end == -1:
+                break
+            if end > start:
+                frames.append(bytes(self.buffer[start:end]))
+            start = end + 1
+
+        del self.buffer[:start]
+
+        # незавершенный хвост не должен расти бесконечно
+        if len(self.buffer) > self.max_frame_size:
+            self.buffer.clear()
+            raise FrameTooLargeError(f"Сообщение больше {self.max_frame_size} байт")
+
+        return frames
@@ -1,52 +1,488 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import secrets
 import socket
+import tempfile
 import threading
 import json
 import time
-import unicodedata
+from collections import deque
 from datetime import datetime
 
+from cluster import BusClient, MessageBus
+from history import HISTORY_PAGE, HISTORY_SIZE, LOG_FSYNC_INTERVAL, ChatLog, MessageHistory
+from protocol import (COMPRESSION, DELIMITER, PING_FRAME, PONG_FRAME, RECV_SIZE, FrameCompressor, FrameDecoder,
+                      FrameTooLargeError, clean_name, clean_unicode, decode_frame, encode_event)
+from metrics import METRICS_HOST, ChatMetrics, MetricsServer, TimedLock
+from timers import TimerWheel
+
 # параметры сервера
 HOST = 'localhost'
 PORT = 8083
+BACKLOG = 128  # размер очереди входящих подключений
+MAX_SEND_QUEUE = 1024  # максимальное число неотправленных кадров на клиента
+SLOW_CLIENT_POLICIES = ('drop_oldest', 'disconnect')
+SLOW_CLIENT_POLICY = 'drop_oldest'  # что делать при переполнении очереди клиента
+DEFAULT_ROOM = 'general'  # комната, в которую попадает каждый новый пользователь
+MAX_ROOM_NAME = 32  # максимальная длина названия комнаты
+HEARTBEAT_INTERVAL = 30.0  # секунд простоя до ping клиенту; 0 - без проверки активности
+IDLE_TIMEOUT = 90.0  # секунд без данных от клиента до разрыва соединения
+PRESENCE_WINDOW = 0.5  # секунд накопления входов/выходов в одно presence_delta; 0 - сразу
+ROSTER_LOG = 1024  # число последних изменений списка пользователей для инкрементальной синхронизации
+RESUME_TIMEOUT = 30.0  # секунд, которые сессия ждет переподключения клиента; 0 - без возобновления
+RESUME_BUFFER = 64 * 1024  # байт последних отправленных кадров для повтора после переподключения
+# ключ таймера ожидания переподключения - (соединение, RESUME_TIMER): у проверки
+# активности ключ - само соединение, и таймеры не заменяют друг друга
+RESUME_TIMER = 'resume'
+# типы сообщений клиента; остальные учитываются в метриках как 'unknown'
+MESSAGE_TYPES = frozenset(('message', 'private', 'session_request', 'session_response', 'session_end',
+                           'users', 'join', 'leave', 'history', 'ping', 'pong', 'quit', 'rooms'))
+# ограничения частоты {тип сообщения: (сообщений в секунду, запас на всплеск)};
+# '*' - общий лимит соединения на кадры любого типа
+RATE_LIMITS = {
+    '*': (20.0, 40),
+    'message': (5.0, 10),
+    'private': (5.0, 10),
+    'session_request': (0.5, 3),
+    'users': (1.0, 5),
+    'rooms': (1.0, 5),
+    'history': (2.0, 5),
+    'join': (1.0, 5),
+}
 
-class ChatServer:
-    def __init__(self, host, port):
-        self.host = host
-        self.port = port
-        self.server_socket = None
-        self.clients = {}  # {client_socket: {'username': str, 'address': tuple}}
-        self.clients_lock = threading.Lock()
-        self.running = False
+class SendQueue:
+    """Ограниченная очередь исходящих кадров клиента с политикой переполнения"""
+    def __init__(self, max_size=MAX_SEND_QUEUE, policy=SLOW_CLIENT_POLICY):
+        if policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError(f"Неизвестная политика медленного клиента: {policy}")
+        self.frames = deque()
+        self.max_size = max_size
+        self.policy = policy
+        self.dropped = 0  # число выброшенных кадров
+    
+    def put(self, data):
+        """Добавление кадра, возвращает False, если клиента нужно отключить"""
+        if len(self.frames) >= self.max_size:
+            if self.policy == 'disconnect':
+                return False
+            # drop_oldest: выбрасываем самый старый кадр
+            self.frames.popleft()
+            self.dropped += 1
+        self.frames.append(data)
+        return True
+    
+    def take_all(self):
+        """Извлечение всех накопленных кадров одним блоком"""
+        batch = b''.join(self.frames)
+        self.frames.clear()
+        return batch
+
+class TokenBucket:
+    """Маркерная корзина: rate маркеров в секунду, в запасе не больше burst"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+    
+    def take(self, now):
+        """Списание одного маркера, False - если корзина пуста"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class RateLimiter:
+    """Ограничение частоты кадров одного клиента: общий лимит и лимиты по типам
+    
+    Вызывается только из цикла чтения своего клиента, поэтому обходится без блокировок.
+    """
+    def __init__(self, limits=RATE_LIMITS):
+        self.buckets = {message_type: TokenBucket(rate, burst) for message_type, (rate, burst) in limits.items()}
+        self.warned = False  # клиент уже предупрежден о превышении лимита
+    
+    def allow(self, message_type):
+        now = time.monotonic()
+        total = self.buckets.get('*')
+        if total is not None and not total.take(now):
+            return False
+        bucket = self.buckets.get(message_type) if isinstance(message_type, str) else None
+        return bucket is None or bucket.take(now)
+
+class ReplayBuffer:
+    """Последние записанные клиенту пачки кадров для повтора после переподключения
+    
+    Кадры нумеруются в порядке записи в сокет, клиент считает полученные кадры
+    так же, поэтому номер последнего полученного кадра точно определяет, что
+    нужно отправить повторно. Объем буфера ограничен max_bytes.
+    """
+    def __init__(self, max_bytes=0):
+        self.batches = deque()  # [(номер первого кадра пачки, пачка)]
+        self.size = 0
+        self.max_bytes = max_bytes
+        self.written = 0  # номер последнего записанного кадра
     
-    def clean_unicode(self, text):
-        """Очистка текста от некорректных Unicode-символов"""
-        if not isinstance(text, str):
-            return text
+    def record(self, batch):
+        """Учет записанной пачки, возвращает число кадров в ней"""
+        first = self.written + 1
+        count = batch.count(DELIMITER)
+        self.written += count
+        if not self.max_bytes:
+            return count
+        self.batches.append((first, batch))
+        self.size += len(batch)
+        while self.size > self.max_bytes:
+            _, old_batch = self.batches.popleft()
+            self.size -= len(old_batch)
+        return count
+    
+    def take_since(self, seq):
+        """Кадры после номера seq для повтора: (данные, номер, после которого идет повтор, полный ли повтор)
+        
+        Буфер очищается: повторенные кадры будут записаны и пронумерованы заново.
+        """
+        if not isinstance(seq, int) or not 0 <= seq <= self.written:
+            seq = self.written
+        oldest = self.batches[0][0] if self.batches else self.written + 1
+        complete = seq + 1 >= oldest
+        seq = max(seq, oldest - 1)
         
-        # Удаляем суррогатные символы
-        cleaned = ''.join(char for char in text if not (0xD800 <= ord(char) <= 0xDFFF))
+        chunks = []
+        for first, batch in self.batches:
+            if first <= seq:
+                # начало пачки клиент уже получил
+                offset = 0
+                for _ in range(seq - first + 1):
+                    offset = batch.find(DELIMITER, offset) + 1
+                    if not offset:
+                        break
+                batch = batch[offset:] if offset else b''
+            if batch:
+                chunks.append(batch)
         
-        # Нормализуем Unicode
+        self.batches.clear()
+        self.size = 0
+        self.written = seq
+        return b''.join(chunks), seq, complete
+
+class QueuedConnection:
+    """Клиентское подключение с отдельным потоком записи
+    
+    send() только ставит кадр в очередь, поэтому рассылка не ждет медленного
+    клиента: сокет пишет поток-писатель, отправляя накопленные кадры пачкой.
+    Объект подключения - это и сессия пользователя: при обрыве он отвязывается
+    от сокета (кадры продолжают копиться в очереди), а при переподключении
+    продолжает работу на новом сокете.
+    """
+    def __init__(self, client_socket, max_queue=MAX_SEND_QUEUE, policy=SLOW_CLIENT_POLICY, replay_size=0,
+                 metrics=None):
+        self.sock = client_socket
+        self.last_seen = time.monotonic()  # время последних данных от клиента
+        self.queue = SendQueue(max_queue, policy)
+        self.replay = ReplayBuffer(replay_size)
+        self.condition = threading.Condition()
+        self.closing = False
+        self.compressor = None  # сжатие потока, если клиент его запросил
+        self.sending_started = False
+        self.metrics = metrics
+        self.start_writer()
+    
+    def start_writer(self):
+        writer_thread = threading.Thread(target=self.write_loop, args=(self.sock,))
+        writer_thread.daemon = True
+        writer_thread.start()
+    
+    def send(self, data):
+        """Постановка кадра в очередь отправки"""
+        with self.condition:
+            if self.closing:
+                raise ConnectionResetError("Соединение закрыто")
+            if not self.queue.put(data):
+                self.abort()
+                raise ConnectionResetError("Очередь отправки переполнена")
+            self.sending_started = True
+            self.condition.notify()
+    
+    def enable_compression(self):
+        """Включение сжатия потока; возможно только до первого кадра клиенту"""
+        with self.condition:
+            if self.sending_started:
+                return False
+            self.compressor = FrameCompressor()
+            return True
+    
+    def write_loop(self, sock):
+        """Поток-писатель: отправляет накопленные кадры в сокет sock, пока сессия к нему привязана"""
         try:
-            cleaned = unicodedata.normalize('NFKC', cleaned)
+            while True:
+                with self.condition:
+                    while not self.queue.frames and not self.closing and self.sock is sock:
+                        self.condition.wait()
+                    if self.sock is not sock or not self.queue.frames:
+                        break
+                    batch = self.queue.take_all()
+                    frames = self.replay.record(batch)
+                    compressor = self.compressor
+                # сжатие - в потоке-писателе, вне блокировки и вне пути рассылки
+                if compressor is not None:
+                    batch = compressor.compress(batch)
+                sock.sendall(batch)
+                if self.metrics is not None:
+                    self.metrics.record_sent(frames, len(batch))
+        except socket.error:
+            # обрыв: поток чтения увидит закрытый сокет и решит, ждать ли переподключения
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except:
+                pass
+        finally:
+            # сокет, переданный другому объекту или отвязанный, закрывает тот, кто его забрал
+            if self.sock is sock:
+                try:
+                    sock.close()
+                except:
+                    pass
+    
+    def owns(self, sock):
+        return self.sock is sock
+    
+    def attached(self):
+        return self.sock is not None
+    
+    def release(self):
+        """Передача сокета другой сессии (при переподключении): поток записи завершается"""
+        with self.condition:
+            sock = self.sock
+            self.sock = None
+            self.condition.notify()
+        return sock
+    
+    def detach(self, sock):
+        """Отвязка сессии от оборванного сокета sock
+        
+        Возвращает False, если сессия уже продолжена на другом сокете.
+        """
+        with self.condition:
+            if self.sock is not sock:
+                return False
+            self.sock = None
+            self.condition.notify()
+        try:
+            sock.close()
         except:
             pass
+        return True
+    
+    def attach(self, sock, seq, compressor=None):
+        """Привязка сессии к новому сокету; пропущенные клиентом кадры ставятся в начало очереди
         
-        return cleaned
+        Возвращает (прежний сокет или None, номер, после которого идет повтор, полный ли повтор).
+        Запись начинается после resume().
+        """
+        with self.condition:
+            old_sock = self.sock
+            data, seq, complete = self.replay.take_since(seq)
+            if data:
+                self.queue.frames.appendleft(data)
+            self.sock = sock
+            self.compressor = compressor
+            self.last_seen = time.monotonic()
+            self.condition.notify_all()
+        return old_sock, seq, complete
+    
+    def resume(self, frame):
+        """Запуск записи после attach(): первым уходит кадр подтверждения (он не нумеруется)"""
+        if self.compressor is not None:
+            frame = self.compressor.compress(frame)
+        self.sock.sendall(frame)
+        self.start_writer()
+    
+    def interrupt(self):
+        """Разрыв текущего сокета без закрытия сессии (разблокирует recv)"""
+        sock = self.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except:
+                pass
+    
+    def close(self):
+        """Закрытие после отправки уже поставленных в очередь кадров"""
+        with self.condition:
+            self.closing = True
+            self.condition.notify()
+    
+    def abort(self):
+        """Немедленный разрыв соединения (разблокирует recv и sendall)"""
+        with self.condition:
+            self.closing = True
+            self.queue.frames.clear()
+            self.condition.notify()
+        self.interrupt()
+
+class Room:
+    """Комната чата: собственный список участников и собственная блокировка
+    
+    Рассылка в комнате блокирует только эту комнату, поэтому комнаты
+    не конкурируют друг с другом, а стоимость рассылки зависит от размера комнаты.
+    """
+    def __init__(self, name, history_size=HISTORY_SIZE):
+        self.name = name
+        self.members = {}  # {client: username}
+        self.lock = threading.Lock()
+        self.history = MessageHistory(history_size)  # последние сообщения комнаты
+        self.presence = {}  # накопленные изменения {username: True - вошел, False - вышел}
+        self.presence_scheduled = False
+    
+    def add(self, client, username):
+        with self.lock:
+            self.members[client] = username
+            return len(self.members)
+    
+    def remove(self, client):
+        """Удаление участника, возвращает число оставшихся"""
+        with self.lock:
+            self.members.pop(client, None)
+            return len(self.members)
+    
+    def recipients(self, exclude_client=None):
+        """Снимок списка участников для рассылки"""
+        with self.lock:
+            return [client for client in self.members if client is not exclude_client]
+    
+    def usernames(self):
+        with self.lock:
+            return list(self.members.values())
+    
+    def __len__(self):
+        return len(self.members)
+
+class Roster:
+    """Версия списка пользователей и журнал его последних изменений
+    
+    Клиент, знающий версию списка, получает только изменения после нее
+    вместо полного списка.
+    """
+    def __init__(self, log_size=ROSTER_LOG):
+        self.version = 0
+        self.changes = deque(maxlen=log_size)  # [(version, username, online)]
+        self.lock = threading.Lock()
+    
+    def update(self, username, online):
+        with self.lock:
+            self.version += 1
+            self.changes.append((self.version, username, online))
+    
+    def since(self, version):
+        """Изменения после version: (вошедшие, вышедшие, текущая версия)
         
+        Возвращает None, если журнал уже не покрывает version - нужен полный список.
+        """
+        with self.lock:
+            if not isinstance(version, int) or version > self.version:
+                return None
+            if version < self.version and (not self.changes or version < self.changes[0][0] - 1):
+                return None
+            state = {}
+            for change_version, username, online in self.changes:
+                if change_version > version:
+                    state[username] = online
+            current = self.version
+        
+        joined = [username for username, online in state.items() if online]
+        left = [username for username, online in state.items() if not online]
+        return joined, left, current
+
+class PrivateSession:
+    """Принятая приватная сессия двух пользователей
+    
+    Хранит соединения обоих участников, поэтому сообщения сессии уходят
+    собеседнику напрямую, без поиска по имени. Соединение участника из другого
+    рабочего процесса - None: ему сообщения идут по шине.
+    """
+    def __init__(self, members):
+        self.members = members  # {username: client или None}
+    
+    def peer(self, username):
+        """(имя, соединение) собеседника username"""
+        for name, client in self.members.items():
+            if name != username:
+                return name, client
+        return None, None
+
+class ChatServer:
+    def __init__(self, host, port, max_send_queue=MAX_SEND_QUEUE, slow_client_policy=SLOW_CLIENT_POLICY,
+                 reuse_port=False, bus_path=None, history_size=HISTORY_SIZE,
+                 log_dir=None, log_fsync=LOG_FSYNC_INTERVAL,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, idle_timeout=IDLE_TIMEOUT, rate_limits=None,
+                 compression=True, presence_window=PRESENCE_WINDOW,
+                 resume_timeout=RESUME_TIMEOUT, resume_buffer=RESUME_BUFFER, metrics_port=None):
+        self.host = host
+        self.port = port
+        self.max_send_queue = max_send_queue
+        self.slow_client_policy = slow_client_policy
+        self.reuse_port = reuse_port  # несколько процессов слушают один порт (SO_REUSEPORT)
+        self.bus_path = bus_path  # путь к шине сообщений между рабочими процессами
+        self.bus = None
+        self.history_size = history_size
+        # журнал на диске переживает перезапуск сервера; история комнат прогревается из него
+        self.chat_log = ChatLog(log_dir, log_fsync) if log_dir else None
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.rate_limits = RATE_LIMITS if rate_limits is None else rate_limits
+        self.compression = compression  # соглашаться ли на сжатие потока
+        self.presence_window = presence_window
+        self.resume_timeout = resume_timeout
+        self.resume_buffer = resume_buffer if resume_timeout > 0 else 0
+        self.roster = Roster()  # версия общего списка пользователей (включая другие процессы)
+        # таймеры проверки активности соединений и рассылки presence_delta; обслуживаются одним потоком
+        self.timers = TimerWheel()
+        self.server_socket = None
+        self.clients = {}  # {client: {'username': str, 'address': tuple, 'room': Room}}
+        self.usernames = {}  # индекс {username: client}, согласован с self.clients
+        self.sessions = {}  # {resume_token: client} для возобновления сессии после обрыва
+        self.private_sessions = {}  # {username: PrivateSession} для участников из этого процесса
+        # запросы сессии, ждущие ответа: {(кто запросил, кому)}; хранятся в процессе получателя
+        self.session_requests = set()
+        self.clients_lock = threading.Lock()
+        # комнаты; rooms_lock нужен только при входе/выходе, рассылка берет блокировку комнаты
+        self.rooms = {DEFAULT_ROOM: self.create_room(DEFAULT_ROOM)}
+        self.rooms_lock = threading.Lock()
+        self.running = False
+        # метрики собираются только с metrics_port; без него путь сообщений проверяет лишь metrics is None
+        self.metrics_port = metrics_port
+        self.metrics = ChatMetrics() if metrics_port else None
+        self.metrics_server = None
+        if self.metrics is not None:
+            self.clients_lock = TimedLock(self.clients_lock, self.metrics.clients_lock_wait)
+            self.register_gauges()
+    
     def start(self):
         """Запуск чат-сервера"""
         try:
             # создаем TCP сокет
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             
             # привязываем сокет к адресу и порту
             self.server_socket.bind((self.host, self.port))
+            self.connect_bus()
             
             # начинаем слушать входящие соединения
-            self.server_socket.listen(10)
+            self.server_socket.listen(BACKLOG)
             self.running = True
+            self.start_metrics()
+            
+            # таймеры: проверка активности соединений и рассылка presence_delta
+            timer_thread = threading.Thread(target=self.timer_loop)
+            timer_thread.daemon = True
+            timer_thread.start()
             
             print(f"Многопользовательский чат-сервер запущен на {self.host}:{self.port}")
             print("Ожидание подключений клиентов...")
@@ -83,15 +519,39 @@ class ChatServer:
         
         # закрываем все клиентские соединения
         with self.clients_lock:
-            for client_socket in list(self.clients.keys()):
+            for client in list(self.clients.keys()):
                 try:
-                    client_socket.close()
+                    client.abort()
                 except:
                     pass
             self.clients.clear()
+            self.usernames.clear()
+            self.sessions.clear()
+            self.private_sessions.clear()
+        self.timers = TimerWheel()
+        self.roster = Roster()
+        
+        with self.rooms_lock:
+            self.rooms = {DEFAULT_ROOM: self.create_room(DEFAULT_ROOM)}
+        
+        if self.bus is not None:
+            self.bus.close()
+            self.bus = None
+        
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
         
-        # закрываем серверный сокет
+        # дописываем и синхронизируем на диск все, что осталось в очереди журнала
+        if self.chat_log is not None:
+            self.chat_log.close()
+        
+        # закрываем серверный сокет (shutdown прерывает ожидающий accept)
         if self.server_socket:
+            try:
+                self.server_socket.shutdown(socket.SHUT_RDWR)
+            except:
+                pass
             try:
                 self.server_socket.close()
             except:
@@ -99,273 +559,1187 @@ class ChatServer:
         
         print("Чат-сервер остановлен")
     
+    def register_gauges(self):
+        """Мгновенные значения для метрик: считаются только при запросе /metrics"""
+        def queue_depths():
+            return [len(client.queue.frames) for client in list(self.clients)]
+        
+        metrics = self.metrics
+        metrics.gauge('chat_clients', 'Зарегистрированные пользователи', lambda: len(self.clients))
+        metrics.gauge('chat_sessions_detached', 'Сессии, ждущие переподключения',
+                      lambda: sum(1 for client in list(self.clients) if not client.attached()))
+        metrics.gauge('chat_private_sessions', 'Приватные сессии с участниками из этого процесса',
+                      lambda: len({id(session) for session in list(self.private_sessions.values())}))
+        metrics.gauge('chat_rooms', 'Комнаты', lambda: len(self.rooms))
+        metrics.gauge('chat_send_queue_frames', 'Кадры в очередях отправки всех клиентов',
+                      lambda: sum(queue_depths()))
+        metrics.gauge('chat_send_queue_frames_max', 'Длина самой длинной очереди отправки',
+                      lambda: max(queue_depths(), default=0))
+        metrics.gauge('chat_send_queue_dropped', 'Кадры, выброшенные из очередей подключенных клиентов',
+                      lambda: sum(client.queue.dropped for client in list(self.clients)))
+        metrics.gauge('chat_timers', 'Таймеры в колесе таймеров', lambda: len(self.timers))
+    
+    def start_metrics(self):
+        """Запуск HTTP-порта метрик, если он задан"""
+        if self.metrics is not None and self.metrics_server is None:
+            self.metrics_server = MetricsServer(self.metrics, self.metrics_port)
+            self.metrics_server.start()
+            print(f"Метрики: http://{METRICS_HOST}:{self.metrics_port}/metrics")
+    
+    def connect_bus(self):
+        """Подключение к шине сообщений, если сервер запущен рабочим процессом"""
+        if self.bus_path:
+            self.bus = BusClient(self.bus_path, self)
+    
+    def run_in_server(self, callback, *args):
+        """Выполнение вызова из потока шины; в многопоточном режиме - сразу"""
+        callback(*args)
+    
     def handle_client(self, client_socket, client_address):
         """Обработка клиентского подключения в отдельном потоке"""
         username = None
+        decoder = FrameDecoder()
+        client = QueuedConnection(client_socket, self.max_send_queue, self.slow_client_policy,
+                                  self.resume_buffer, self.metrics)
+        self.watch_connection(client)
+        if self.metrics is not None:
+            self.metrics.connections.inc()
         
         try:
-            # получаем имя пользователя
-            username_data = client_socket.recv(1024).decode('utf-8')
-            if not username_data:
-                return
-            
-            try:
-                username_info = json.loads(username_data)
-                username = self.clean_unicode(username_info.get('username', f'User_{client_address[1]}'))
-            except json.JSONDecodeError:
-                username = f'User_{client_address[1]}'
-            
-            # добавляем клиента в список
-            with self.clients_lock:
-                self.clients[client_socket] = {
-                    'username': username,
-                    'address': client_address,
-                    'join_time': datetime.now()
-                }
-            
-            # отправляем приветственное сообщение
-            welcome_msg = {
-                'type': 'system',
-                'message': f'Добро пожаловать в чат, {username}!',
-                'timestamp': datetime.now().isoformat(),
-                'online_users': len(self.clients)
-            }
-            client_socket.sendall(json.dumps(welcome_msg, ensure_ascii=False).encode('utf-8'))
-            
-            # уведомляем всех о новом пользователе
-            self.broadcast_message({
-                'type': 'user_joined',
-                'username': username,
-                'message': f'{username} присоединился к чату',
-                'timestamp': datetime.now().isoformat(),
-                'online_users': len(self.clients)
-            }, exclude_client=client_socket)
-            
-            print(f"{username} присоединился к чату (всего пользователей: {len(self.clients)})")
-            
             # основной цикл получения сообщений от клиента
             while self.running:
                 try:
-                    data = client_socket.recv(1024).decode('utf-8')
+                    data = client_socket.recv(RECV_SIZE)
                     if not data:
                         break
+                    client.last_seen = time.monotonic()
+                    if self.metrics is not None:
+                        self.metrics.bytes_received.inc(len(data))
                     
-                    # парсим сообщение
-                    try:
-                        message_data = json.loads(data)
-                        message_type = message_data.get('type', 'message')
-                        
-                        if message_type == 'message':
-                            # обычное сообщение
-                            message = self.clean_unicode(message_data.get('message', ''))
-                            if message.strip():
-                                chat_message = {
-                                    'type': 'message',
-                                    'username': username,
-                                    'message': message,
-                                    'timestamp': datetime.now().isoformat()
-                                }
-                                self.broadcast_message(chat_message)
-                                print(f"{username}: {message}")
-                        
-                        elif message_type == 'private':
-                            # приватное сообщение
-                            target_username = self.clean_unicode(message_data.get('target_username', ''))
-                            message = self.clean_unicode(message_data.get('message', ''))
-                            if target_username and message.strip():
-                                self.send_private_message(username, target_username, message)
-                        
-                        elif message_type == 'session_request':
-                            # запрос на приватную сессию
-                            target_username = self.clean_unicode(message_data.get('target_username', ''))
-                            if target_username:
-                                self.request_private_session(username, target_username)
-                        
-                        elif message_type == 'session_response':
-                            # ответ на запрос приватной сессии
-                            target_username = self.clean_unicode(message_data.get('target_username', ''))
-                            accepted = message_data.get('accepted', False)
-                            if target_username:
-                                self.handle_session_response(username, target_username, accepted)
-                        
-                        elif message_type == 'users':
-                            # запрос списка пользователей
-                            users_list = {
-                                'type': 'users_list',
-                                'users': [client_info['username'] for client_info in self.clients.values()],
-                                'timestamp': datetime.now().isoformat()
-                            }
-                            client_socket.sendall(json.dumps(users_list, ensure_ascii=False).encode('utf-8'))
-                    
-                    except json.JSONDecodeError:
-                        print(f"Ошибка парсинга JSON от {username}")
+                    # один recv может содержать несколько сообщений или часть сообщения
+                    for frame in decoder.feed(data):
+                        if username is None:
+                            # первое сообщение - имя пользователя или возобновление сессии
+                            registered, username, client = self.register_client(client, client_address, frame)
+                            if not registered:
+                                return
+                        else:
+                            self.process_message(client, username, frame)
                         
                 except socket.error:
                     break
                     
+        except FrameTooLargeError as e:
+            print(f"Слишком большое сообщение от {username or client_address}: {e}")
         except Exception as e:
             print(f"Ошибка обработки клиента {username or client_address}: {e}")
         
         finally:
-            # удаляем клиента из списка
-            with self.clients_lock:
-                if client_socket in self.clients:
-                    username = self.clients[client_socket]['username']
-                    del self.clients[client_socket]
-            
-            # уведомляем всех о выходе пользователя
-            if username:
-                self.broadcast_message({
-                    'type': 'user_left',
-                    'username': username,
-                    'message': f'{username} покинул чат',
-                    'timestamp': datetime.now().isoformat(),
-                    'online_users': len(self.clients)
-                })
-                print(f"{username} покинул чат (осталось пользователей: {len(self.clients)})")
-            
-            # закрываем соединение
+            self.release_client(client, client_socket)
+    
+    def register_client(self, client, client_address, username_data):
+        """Регистрация нового клиента по данным приветствия
+        
+        Возвращает (принят ли клиент, имя пользователя, соединение): при
+        возобновлении сессии дальше работает прежний объект соединения. Если
+        имя уже занято, клиент не принят.
+        """
+        username, session, compressed = self.parse_greeting(client, client_address, username_data)
+        if session is not None:
+            return True, username, session
+        
+        # в кластере имя занимает шина: локальная запись снимается, если имя
+        # уже есть в другом процессе (поток ждет ответа шины)
+        accepted = self.reserve_username(client, client_address, username)
+        if accepted and self.bus is not None and not self.bus.claim_user(username):
+            self.release_username(client, username)
+            accepted = False
+        return self.finish_registration(client, client_address, username, compressed, accepted)
+    
+    def parse_greeting(self, client, client_address, username_data):
+        """Разбор приветствия: (имя, продолженная сессия или None, включено ли сжатие)"""
+        try:
+            username_info = decode_frame(username_data)
+            username = clean_name(username_info.get('username'))
+            requested = username_info.get('compression')
+            resume_token = username_info.get('resume')
+        except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+            username = None
+            requested = None
+            resume_token = None
+        # имя - непустая строка, иначе (нет имени, null, список...) - имя по порту клиента
+        if not isinstance(username, str) or not username:
+            username = f'User_{client_address[1]}'
+        
+        if resume_token and self.resume_timeout > 0:
+            session = self.resume_session(client, username, resume_token, username_info.get('last_seq'), requested)
+            if session is not None:
+                return username, session, False
+        
+        # сжатие включается до первого кадра клиенту, включая кадр ошибки
+        compressed = (self.compression and isinstance(requested, list) and COMPRESSION in requested
+                      and client.enable_compression())
+        return username, None, compressed
+    
+    def reserve_username(self, client, client_address, username):
+        """Добавление клиента в список, False - имя уже занято в этом процессе"""
+        with self.clients_lock:
+            if username in self.usernames:
+                return False
+            self.clients[client] = {
+                'username': username,
+                'address': client_address,
+                'join_time': datetime.now(),
+                'room': None,
+                'limiter': RateLimiter(self.rate_limits)
+            }
+            self.usernames[username] = client
+        return True
+    
+    def release_username(self, client, username):
+        """Отмена reserve_username: шина отдала имя другому процессу"""
+        with self.clients_lock:
+            self.clients.pop(client, None)
+            self.usernames.pop(username, None)
+    
+    def finish_registration(self, client, client_address, username, compressed, accepted):
+        """Приветствие и вход в общую комнату или отказ, если имя занято"""
+        if not accepted:
             try:
-                client_socket.close()
-            except:
+                client.send(encode_event('error', message=f'Имя {username} уже занято, выберите другое'))
+            except socket.error:
                 pass
+            print(f"Отклонено подключение {client_address}: имя {username} уже занято")
+            return False, username, client
+        
+        self.roster.update(username, True)
+        
+        # токен возобновления позволяет продолжить сессию после обрыва соединения
+        resume_token = None
+        if self.resume_timeout > 0:
+            resume_token = secrets.token_urlsafe(16)
+            with self.clients_lock:
+                if client in self.clients:
+                    self.clients[client]['resume_token'] = resume_token
+                    self.sessions[resume_token] = client
+        
+        # отправляем приветственное сообщение
+        client.send(encode_event('system',
+                                 message=f'Добро пожаловать в чат, {username}!',
+                                 online_users=len(self.clients),
+                                 room=DEFAULT_ROOM,
+                                 compression=COMPRESSION if compressed else None,
+                                 resume_token=resume_token,
+                                 resume_timeout=self.resume_timeout if resume_token else None))
+        
+        # входим в общую комнату, участники комнаты получат уведомление
+        self.join_room(client, username, DEFAULT_ROOM)
+        
+        print(f"{username} присоединился к чату (всего пользователей: {len(self.clients)})")
+        return True, username, client
     
-    def broadcast_message(self, message_data, exclude_client=None):
-        """Отправка сообщения всем клиентам"""
-        message_json = json.dumps(message_data, ensure_ascii=False).encode('utf-8')
+    def resume_session(self, client, username, resume_token, last_seq, requested):
+        """Продолжение сессии на новом соединении client
         
+        Сокет переходит от временного соединения к сохраненной сессии; клиент
+        получает кадр resumed и все кадры после last_seq, которые еще есть в
+        буфере повтора. Комната и присутствие не меняются, поэтому участники
+        не видят ни выхода, ни входа. Возвращает сессию или None, если токен
+        неизвестен (тогда выполняется обычная регистрация).
+        """
         with self.clients_lock:
-            disconnected_clients = []
+            session = self.sessions.get(resume_token)
+            client_info = self.clients.get(session)
+            if client_info is None or client_info['username'] != username:
+                return None
+            room = client_info['room']
+        
+        self.timers.cancel(client)
+        self.timers.cancel((session, RESUME_TIMER))
+        compressor = None
+        if self.compression and isinstance(requested, list) and COMPRESSION in requested:
+            compressor = FrameCompressor()
+        old_handle, seq, complete = session.attach(client.release(), last_seq, compressor)
+        if old_handle is not None:
+            # сессия еще была привязана к прежнему соединению: оно закрывается
+            self.close_handle(old_handle)
+        
+        try:
+            session.resume(encode_event('resumed',
+                                        username=username,
+                                        room=room.name if room is not None else DEFAULT_ROOM,
+                                        seq=seq,
+                                        complete=complete,
+                                        compression=COMPRESSION if compressor else None))
+        except socket.error:
+            session.interrupt()
+        self.watch_connection(session)
+        if self.metrics is not None:
+            self.metrics.resumed.inc()
+        
+        print(f"{username} переподключился и продолжил сессию")
+        return session
+    
+    def release_client(self, client, handle):
+        """Завершение цикла чтения соединения handle (сокета или StreamWriter)
+        
+        Если клиент отключился сам (/quit) или возобновление выключено, клиент
+        удаляется сразу. Иначе сессия отвязывается от соединения и ждет
+        переподключения resume_timeout секунд: пользователь остается в комнате,
+        а кадры для него копятся в очереди.
+        """
+        client_info = self.clients.get(client)
+        if (client_info is None or client_info.get('quit') or self.resume_timeout <= 0
+                or not self.running or client.closing):
+            if client.owns(handle):
+                self.unregister_client(client)
+            else:
+                self.close_handle(handle)
+            return
+        
+        if client.detach(handle):
+            self.timers.schedule((client, RESUME_TIMER), self.resume_timeout, self.expire_session)
+            print(f"{client_info['username']} потерял соединение, сессия ждет переподключения {self.resume_timeout:g} с")
+    
+    def expire_session(self, key):
+        """Срабатывание таймера (соединение, RESUME_TIMER): клиент не переподключился вовремя"""
+        client, _ = key
+        if client.closing or client.attached():
+            return
+        print(f"Сессия {self.clients.get(client, {}).get('username', 'без имени')} истекла")
+        self.unregister_client(client)
+    
+    def close_handle(self, handle):
+        """Закрытие сокета, который больше не принадлежит сессии"""
+        try:
+            handle.shutdown(socket.SHUT_RDWR)
+        except:
+            pass
+        try:
+            handle.close()
+        except:
+            pass
+    
+    def process_message(self, client, username, data):
+        """Разбор и обработка одного сообщения от клиента"""
+        try:
+            message_data = decode_frame(data)
+            message_type = message_data.get('type', 'message')
             
-            for client_socket, client_info in self.clients.items():
-                if client_socket != exclude_client:
-                    try:
-                        client_socket.sendall(message_json)
-                    except socket.error:
-                        disconnected_clients.append(client_socket)
+            metrics = self.metrics
+            if metrics is not None:
+                metric_type = message_type if isinstance(message_type, str) and message_type in MESSAGE_TYPES else 'unknown'
+                metrics.frames_received.inc(label_value=metric_type)
             
-            # удаляем отключившихся клиентов
-            for client_socket in disconnected_clients:
-                try:
-                    client_socket.close()
-                except:
-                    pass
-                del self.clients[client_socket]
+            client_info = self.clients.get(client)
+            if client_info is None:
+                # клиент уже удален, например отключен при переполнении очереди во время рассылки
+                return
+            
+            # лимит проверяется до любой рассылки: лишние кадры отбрасываются сразу
+            limiter = client_info['limiter']
+            if not limiter.allow(message_type):
+                if metrics is not None:
+                    metrics.rate_limited.inc(label_value=metric_type)
+                if not limiter.warned:
+                    limiter.warned = True
+                    client.send(encode_event('error', message='Слишком много сообщений, лишние отброшены'))
+                    print(f"{username} превысил лимит частоты ({message_type})")
+                return
+            limiter.warned = False
+            
+            if message_type == 'message':
+                # обычное сообщение
+                message = clean_unicode(message_data.get('message', ''))
+                if message.strip():
+                    room = self.clients[client]['room']
+                    timestamp = datetime.now().isoformat()
+                    frame = encode_event('message', timestamp, username=username, message=message, room=room.name)
+                    self.broadcast_message(frame, room, timestamp=timestamp)
+                    print(f"[{room.name}] {username}: {message}")
+            
+            elif message_type == 'private':
+                # приватное сообщение
+                target_username = clean_name(message_data.get('target_username', ''))
+                message = clean_unicode(message_data.get('message', ''))
+                if target_username and message.strip():
+                    self.send_private_message(username, target_username, message)
+            
+            elif message_type == 'session_request':
+                # запрос на приватную сессию
+                target_username = clean_name(message_data.get('target_username', ''))
+                if target_username:
+                    self.request_private_session(username, target_username)
+            
+            elif message_type == 'session_response':
+                # ответ на запрос приватной сессии
+                target_username = clean_name(message_data.get('target_username', ''))
+                accepted = message_data.get('accepted', False)
+                if target_username:
+                    self.handle_session_response(username, target_username, accepted)
+            
+            elif message_type == 'session_end':
+                # выход из приватной сессии: собеседник получит session_ended
+                self.end_private_session(username, f'{username} завершил приватную сессию')
+            
+            elif message_type == 'users':
+                # запрос списка пользователей: всех или одной комнаты
+                room_name = message_data.get('room')
+                if room_name:
+                    with self.rooms_lock:
+                        room = self.rooms.get(clean_name(room_name))
+                    users = room.usernames() if room is not None else []
+                    client.send(encode_event('users_list', users=users, room=room_name))
+                else:
+                    self.send_roster(client, message_data.get('since'))
+            
+            elif message_type == 'join':
+                # переход в другую комнату
+                room_name = self.clean_room_name(message_data.get('room', ''))
+                if not room_name:
+                    client.send(encode_event('error', message=f'Некорректное название комнаты (до {MAX_ROOM_NAME} символов)'))
+                elif room_name == self.clients[client]['room'].name:
+                    client.send(encode_event('error', message=f'Вы уже в комнате {room_name}'))
+                else:
+                    self.join_room(client, username, room_name)
+            
+            elif message_type == 'leave':
+                # выход из комнаты - возврат в общую комнату
+                if self.clients[client]['room'].name == DEFAULT_ROOM:
+                    client.send(encode_event('error', message='Из общей комнаты выйти нельзя, используйте /quit'))
+                else:
+                    self.join_room(client, username, DEFAULT_ROOM)
+            
+            elif message_type == 'history':
+                # страница истории текущей комнаты, начиная после метки since
+                self.send_history(client, message_data.get('since'), message_data.get('limit', HISTORY_PAGE))
+            
+            elif message_type == 'ping':
+                client.send(PONG_FRAME)
+            
+            elif message_type == 'quit':
+                # явный выход: после разрыва сессия не ждет переподключения
+                self.clients[client]['quit'] = True
+            
+            elif message_type == 'pong':
+                # ответ на проверку активности: время last_seen уже обновлено при чтении
+                pass
+            
+            elif message_type == 'rooms':
+                # список комнат с числом участников
+                with self.rooms_lock:
+                    rooms = [{'name': room.name, 'users': len(room)} for room in self.rooms.values()]
+                client.send(encode_event('rooms_list', rooms=rooms))
+        
+        except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+            print(f"Ошибка парсинга JSON от {username}")
     
-    def send_private_message(self, from_username, to_username, message):
-        """Отправка приватного сообщения"""
-        private_msg = {
-            'type': 'private',
-            'from_username': from_username,
-            'message': message,
-            'timestamp': datetime.now().isoformat()
-        }
+    def unregister_client(self, client):
+        """Удаление клиента из списка и уведомление остальных"""
+        self.timers.cancel(client)
+        self.timers.cancel((client, RESUME_TIMER))
+        username, room = self.remove_client(client)
+        
+        # участники комнаты узнают о выходе из ближайшего presence_delta
+        if username:
+            if room is not None:
+                self.announce_presence(room, username, False)
+            self.end_private_session(username, f'{username} покинул чат')
+            self.drop_session_requests(username)
+            print(f"{username} покинул чат (осталось пользователей: {len(self.clients)})")
         
+        # закрываем соединение
+        try:
+            client.close()
+        except:
+            pass
+    
+    def watch_connection(self, client):
+        """Постановка соединения на проверку активности"""
+        if self.heartbeat_interval > 0:
+            self.timers.schedule(client, self.heartbeat_interval, self.check_connection)
+    
+    def check_connection(self, client):
+        """Срабатывание таймера: ping простаивающему клиенту, разрыв после idle_timeout
+        
+        Разорванное соединение завершает цикл чтения клиента, а тот уже
+        удаляет клиента или оставляет сессию ждать переподключения.
+        Отвязанную сессию не проверяем: ее судьбу решает таймер переподключения,
+        а после resume_session проверка ставится заново.
+        """
+        if client.closing or not client.attached():
+            return
+        idle = time.monotonic() - client.last_seen
+        if idle >= self.idle_timeout:
+            client_info = self.clients.get(client)
+            name = client_info['username'] if client_info else 'без имени'
+            print(f"Клиент {name} не отвечает {idle:.0f} с, соединение закрыто")
+            client.interrupt()
+            return
+        
+        if idle >= self.heartbeat_interval:
+            try:
+                client.send(PING_FRAME)
+            except ConnectionResetError:
+                return
+            delay = min(self.heartbeat_interval, self.idle_timeout - idle)
+        else:
+            # данные приходили: следующая проверка - через интервал после них
+            delay = self.heartbeat_interval - idle
+        self.timers.schedule(client, delay, self.check_connection)
+    
+    def run_timers(self):
+        """Выполнение сработавших таймеров"""
+        for client, callback in self.timers.advance():
+            callback(client)
+    
+    def timer_loop(self):
+        """Поток таймеров: один на все соединения и комнаты"""
+        while self.running:
+            time.sleep(self.timers.tick)
+            self.run_timers()
+    
+    def remove_client(self, client):
+        """Удаление клиента из списка, индекса имен и комнаты
+        
+        Возвращает (имя, комната) или (None, None), если клиент уже удален.
+        """
         with self.clients_lock:
-            for client_socket, client_info in self.clients.items():
-                if client_info['username'] == to_username:
-                    try:
-                        client_socket.sendall(json.dumps(private_msg, ensure_ascii=False).encode('utf-8'))
-                        print(f"Приватное сообщение от {from_username} к {to_username}: {message}")
-                        return
-                    except socket.error:
-                        pass
+            client_info = self.clients.pop(client, None)
+            if client_info is None:
+                return None, None
+            username = client_info['username']
+            if self.usernames.get(username) is client:
+                del self.usernames[username]
+            self.sessions.pop(client_info.get('resume_token'), None)
         
-        # если получатель не найден, отправляем ошибку отправителю
-        error_msg = {
-            'type': 'error',
-            'message': f'Пользователь {to_username} не найден',
-            'timestamp': datetime.now().isoformat()
-        }
+        self.roster.update(username, False)
+        if self.bus is not None:
+            self.bus.publish_presence(username, False)
+        
+        room = client_info['room']
+        if room is not None:
+            self.leave_room(client, room)
+        return username, room
+    
+    def clean_room_name(self, room_name):
+        """Проверка и нормализация названия комнаты, возвращает '' если оно некорректно"""
+        if not isinstance(room_name, str):
+            return ''
+        room_name = clean_name(room_name).strip()
+        if len(room_name) > MAX_ROOM_NAME:
+            return ''
+        return room_name
+    
+    def join_room(self, client, username, room_name):
+        """Перевод клиента в комнату с уведомлением участников старой и новой комнаты"""
+        old_room = self.clients[client]['room']
+        if old_room is not None:
+            self.leave_room(client, old_room)
+            self.announce_presence(old_room, username, False)
+        
+        # комнаты создаются при первом входе; вход и выход - редкие операции,
+        # поэтому общая блокировка rooms_lock не мешает рассылкам
+        with self.rooms_lock:
+            room = self.rooms.get(room_name)
+            if room is None:
+                room = self.rooms[room_name] = self.create_room(room_name)
+            online = room.add(client, username)
+        self.clients[client]['room'] = room
+        
+        # приветствие комнаты и вся сохраненная история уходят одной записью
+        client.send(encode_event('room_joined', room=room_name, online_users=online,
+                                 history=len(room.history)) + room.history.replay())
+        self.announce_presence(room, username, True)
+        return room
+    
+    def create_room(self, room_name):
+        """Новая комната; история загружается из хвоста журнала, если он ведется"""
+        room = Room(room_name, self.history_size)
+        if self.chat_log is not None:
+            for frame in self.chat_log.tail(room_name, self.history_size):
+                room.history.append(decode_frame(frame).get('timestamp'), frame)
+        return room
+    
+    def announce_presence(self, room, username, joined):
+        """Накопление входа или выхода участника комнаты
         
+        Участники получают одно presence_delta за окно presence_window вместо
+        кадра на каждое событие; вход и выход в одном окне взаимно гасятся,
+        поэтому переподключение без смены состава не рассылается вовсе.
+        """
+        with room.lock:
+            if room.presence.get(username, joined) != joined:
+                del room.presence[username]
+            else:
+                room.presence[username] = joined
+            schedule = not room.presence_scheduled
+            room.presence_scheduled = True
+        
+        if not schedule:
+            return
+        if self.presence_window > 0:
+            self.timers.schedule(room, self.presence_window, self.flush_presence)
+        else:
+            self.flush_presence(room)
+    
+    def flush_presence(self, room):
+        """Рассылка накопленных изменений состава комнаты одним кадром"""
+        with room.lock:
+            changes = room.presence
+            room.presence = {}
+            room.presence_scheduled = False
+            online = len(room.members)
+        if not changes:
+            return
+        
+        self.broadcast_message(encode_event('presence_delta',
+                                            room=room.name,
+                                            joined=[username for username, joined in changes.items() if joined],
+                                            left=[username for username, joined in changes.items() if not joined],
+                                            online_users=online), room)
+    
+    def leave_room(self, client, room):
+        """Удаление клиента из комнаты; пустые комнаты (кроме общей) удаляются"""
+        with self.rooms_lock:
+            if not room.remove(client) and room.name != DEFAULT_ROOM and self.rooms.get(room.name) is room:
+                del self.rooms[room.name]
+    
+    def get_usernames(self):
+        """Список имен пользователей онлайн (во всех рабочих процессах)"""
         with self.clients_lock:
-            for client_socket, client_info in self.clients.items():
-                if client_info['username'] == from_username:
-                    try:
-                        client_socket.sendall(json.dumps(error_msg, ensure_ascii=False).encode('utf-8'))
-                        break
-                    except socket.error:
-                        pass
+            usernames = list(self.usernames)
+        if self.bus is not None:
+            usernames.extend(self.bus.remote_usernames())
+        return usernames
+    
+    def send_roster(self, client, since=None):
+        """Ответ на запрос users: изменения после версии since или полный список"""
+        delta = self.roster.since(since) if since is not None else None
+        if delta is not None:
+            joined, left, version = delta
+            client.send(encode_event('users_delta', joined=joined, left=left, version=version))
+            return
+        # версия берется до списка: изменение между ними клиент получит повторно, это безопасно
+        version = self.roster.version
+        client.send(encode_event('users_list', users=self.get_usernames(), version=version))
+    
+    def broadcast_message(self, frame, room, exclude_client=None, timestamp=None):
+        """Отправка готового кадра всем участникам комнаты, в том числе в других процессах
+        
+        Кадры с временной меткой (сообщения чата) сохраняются в истории комнаты.
+        """
+        if timestamp is not None:
+            room.history.append(timestamp, frame)
+            # в режиме нескольких процессов журнал ведет шина, через которую проходят все сообщения
+            if self.chat_log is not None and self.bus is None:
+                self.chat_log.append(room.name, frame)
+        self.send_to_room(frame, room, exclude_client)
+        if self.bus is not None:
+            self.bus.publish_room(room.name, frame, timestamp)
+    
+    def deliver_to_room(self, room_name, frame, timestamp=None):
+        """Доставка кадра, пришедшего по шине, локальным участникам комнаты"""
+        with self.rooms_lock:
+            room = self.rooms.get(room_name)
+        if room is not None:
+            if timestamp is not None:
+                room.history.append(timestamp, frame)
+            self.send_to_room(frame, room)
+    
+    def send_history(self, client, since, limit):
+        """Ответ на запрос history: кадры истории и итоговый history_end одной записью"""
+        room = self.clients[client]['room']
+        if not isinstance(since, str):
+            since = None
+        if not isinstance(limit, int) or not 0 < limit <= HISTORY_PAGE:
+            limit = HISTORY_PAGE
+        
+        frames, last_timestamp, has_more = room.history.since(since, limit)
+        frames.append(encode_event('history_end', room=room.name, count=len(frames),
+                                   next_since=last_timestamp, has_more=has_more))
+        client.send(b''.join(frames))
+    
+    def send_to_room(self, frame, room, exclude_client=None):
+        """Отправка готового кадра локальным участникам комнаты
+        
+        Один и тот же объект bytes ставится в очередь каждого получателя,
+        поэтому стоимость сериализации не зависит от числа клиентов.
+        """
+        metrics = self.metrics
+        if metrics is not None:
+            start = time.perf_counter()
+        
+        # отправка только ставит кадр в очереди клиентов, блокировка комнаты нужна лишь для снимка списка
+        disconnected_clients = []
+        recipients = room.recipients(exclude_client)
+        for client in recipients:
+            try:
+                client.send(frame)
+            except socket.error:
+                disconnected_clients.append(client)
+        
+        if metrics is not None:
+            metrics.broadcast_seconds.observe(time.perf_counter() - start)
+            metrics.broadcast_recipients.observe(len(recipients))
+        
+        # удаляем отключившихся клиентов тем же путем, что и при обычном выходе:
+        # собеседник по приватной сессии и комнаты узнают об уходе
+        for client in disconnected_clients:
+            self.unregister_client(client)
+    
+    def send_private_message(self, from_username, to_username, message):
+        """Отправка приватного сообщения"""
+        private_msg = encode_event('private', from_username=from_username, message=message)
+        
+        # в приватной сессии соединение собеседника уже известно
+        session = self.private_sessions.get(from_username)
+        if session is not None:
+            peer_name, peer_client = session.peer(from_username)
+            if peer_name == to_username and peer_client is not None:
+                try:
+                    peer_client.send(private_msg)
+                    print(f"Приватное сообщение в сессии {from_username} -> {to_username}: {message}")
+                    return
+                except socket.error:
+                    pass
+        
+        if self.send_to_user(to_username, private_msg):
+            print(f"Приватное сообщение от {from_username} к {to_username}: {message}")
+            return
+        
+        # если получатель не найден, отправляем ошибку отправителю
+        self.send_to_user(from_username, encode_event('error', message=f'Пользователь {to_username} не найден'))
     
     def request_private_session(self, from_username, to_username):
         """Запрос на приватную сессию"""
         if from_username == to_username:
             # отправляем ошибку отправителю
-            error_msg = {
-                'type': 'error',
-                'message': 'Нельзя создать сессию с самим собой',
-                'timestamp': datetime.now().isoformat()
-            }
-            self.send_to_user(from_username, error_msg)
+            self.send_to_user(from_username, encode_event('error', message='Нельзя создать сессию с самим собой'))
             return
         
         # отправляем запрос получателю
-        session_request = {
-            'type': 'session_request',
-            'from_username': from_username,
-            'message': f'{from_username} хочет начать приватную сессию с вами',
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        if self.send_to_user(to_username, session_request):
+        session_request = encode_event('session_request',
+                                       from_username=from_username,
+                                       message=f'{from_username} хочет начать приватную сессию с вами')
+        
+        if self.deliver_session_request(from_username, to_username, session_request):
+            print(f"{from_username} запросил приватную сессию с {to_username}")
+        elif self.bus is not None and self.bus.has_user(to_username):
+            # запрос запомнит процесс получателя, туда же придет ответ
+            self.bus.publish_session_request(from_username, to_username, session_request)
             print(f"{from_username} запросил приватную сессию с {to_username}")
         else:
             # получатель не найден
-            error_msg = {
-                'type': 'error',
-                'message': f'Пользователь {to_username} не найден',
-                'timestamp': datetime.now().isoformat()
-            }
-            self.send_to_user(from_username, error_msg)
+            self.send_to_user(from_username, encode_event('error', message=f'Пользователь {to_username} не найден'))
+    
+    def deliver_session_request(self, from_username, to_username, frame):
+        """Запоминание запроса сессии и доставка кадра локальному получателю
+        
+        Ответ session_response принимается, только если ему предшествовал
+        такой запрос. Возвращает False, если получателя нет в этом процессе.
+        """
+        with self.clients_lock:
+            client = self.usernames.get(to_username)
+            if client is None:
+                return False
+            self.session_requests.add((from_username, to_username))
+        try:
+            client.send(frame)
+            return True
+        except socket.error:
+            return False
+    
+    def drop_session_requests(self, username):
+        """Забыть ожидающие запросы сессии, в которых участвует username"""
+        with self.clients_lock:
+            self.session_requests = {request for request in self.session_requests if username not in request}
     
     def handle_session_response(self, responder_username, target_username, accepted):
-        """Обработка ответа на запрос приватной сессии"""
+        """Обработка ответа на запрос приватной сессии
+        
+        target_username - автор запроса; ответ без ожидающего запроса отклоняется.
+        """
+        with self.clients_lock:
+            request = (target_username, responder_username)
+            requested = request in self.session_requests
+            self.session_requests.discard(request)
+        if not requested:
+            self.send_to_user(responder_username,
+                              encode_event('error', message=f'Нет запроса на приватную сессию от {target_username}'))
+            print(f"{responder_username} ответил на несуществующий запрос сессии от {target_username}")
+            return
+        
         if accepted:
-            # сессия принята - уведомляем обоих пользователей одинаковым сообщением
-            success_msg = {
-                'type': 'session_accepted',
-                'from_username': target_username,
-                'to_username': responder_username,
-                'message': f'Приватная сессия между {target_username} и {responder_username} установлена',
-                'timestamp': datetime.now().isoformat()
-            }
+            # сессия принята - уведомляем обоих пользователей одним и тем же кадром
+            success_msg = encode_event('session_accepted',
+                                       from_username=target_username,
+                                       to_username=responder_username,
+                                       message=f'Приватная сессия между {target_username} и {responder_username} установлена')
             
+            self.open_private_session(target_username, responder_username)
             self.send_to_user(target_username, success_msg)
             self.send_to_user(responder_username, success_msg)
             
             print(f"{responder_username} принял приватную сессию с {target_username}")
         else:
-            # сессия отклонена - уведомляем обоих пользователей одинаковым сообщением
-            reject_msg = {
-                'type': 'session_rejected',
-                'from_username': target_username,
-                'to_username': responder_username,
-                'message': f'Приватная сессия между {target_username} и {responder_username} отклонена',
-                'timestamp': datetime.now().isoformat()
-            }
+            # сессия отклонена - уведомляем обоих пользователей одним и тем же кадром
+            reject_msg = encode_event('session_rejected',
+                                      from_username=target_username,
+                                      to_username=responder_username,
+                                      message=f'Приватная сессия между {target_username} и {responder_username} отклонена')
             
             self.send_to_user(target_username, reject_msg)
             self.send_to_user(responder_username, reject_msg)
             
             print(f"{responder_username} отклонил приватную сессию с {target_username}")
     
-    def send_to_user(self, username, message_data):
-        """Отправка сообщения конкретному пользователю"""
-        message_json = json.dumps(message_data, ensure_ascii=False).encode('utf-8')
+    def open_private_session(self, first_username, second_username):
+        """Создание сессии с соединениями обоих участников
+        
+        Прежние сессии участников с другими собеседниками завершаются:
+        у пользователя одна приватная сессия.
+        """
+        for username, other in ((first_username, second_username), (second_username, first_username)):
+            session = self.private_sessions.get(username)
+            if session is not None and session.peer(username)[0] != other:
+                self.end_private_session(username, f'{username} начал другую приватную сессию')
         
         with self.clients_lock:
-            for client_socket, client_info in self.clients.items():
-                if client_info['username'] == username:
-                    try:
-                        client_socket.sendall(message_json)
-                        return True
-                    except socket.error:
-                        pass
+            session = PrivateSession({username: self.usernames.get(username)
+                                      for username in (first_username, second_username)})
+            for username, client in session.members.items():
+                if client is not None:
+                    self.private_sessions[username] = session
+    
+    def end_private_session(self, username, message):
+        """Завершение сессии пользователя, собеседник получает session_ended"""
+        with self.clients_lock:
+            session = self.private_sessions.pop(username, None)
+            if session is None:
+                return
+            peer_name, peer_client = session.peer(username)
+            if self.private_sessions.get(peer_name) is session:
+                del self.private_sessions[peer_name]
+        
+        frame = encode_event('session_ended', from_username=username, to_username=peer_name, message=message)
+        if peer_client is None:
+            # собеседник в другом рабочем процессе
+            self.send_to_user(peer_name, frame)
+        else:
+            try:
+                peer_client.send(frame)
+            except socket.error:
+                pass
+        print(f"Приватная сессия {username} и {peer_name} завершена")
+    
+    def remote_user_left(self, username):
+        """Пользователь другого рабочего процесса вышел из сети
+        
+        Его процесс не знает о сессиях, принятых здесь, поэтому локальные
+        участники сессий с ним получают session_ended от этого процесса.
+        """
+        self.drop_session_requests(username)
+        with self.clients_lock:
+            ended = [(name, session.members[name]) for name, session in self.private_sessions.items()
+                     if session.peer(name)[0] == username]
+            for name, _ in ended:
+                del self.private_sessions[name]
+        
+        for name, client in ended:
+            try:
+                client.send(encode_event('session_ended', from_username=username, to_username=name,
+                                         message=f'{username} покинул чат'))
+            except socket.error:
+                pass
+            print(f"Приватная сессия {username} и {name} завершена")
+    
+    def send_to_user(self, username, frame, forward=True):
+        """Отправка готового кадра конкретному пользователю
+        
+        Если пользователь подключен к другому рабочему процессу, кадр уходит по шине.
+        """
+        with self.clients_lock:
+            client = self.usernames.get(username)
+        if client is None:
+            if forward and self.bus is not None and self.bus.has_user(username):
+                self.bus.publish_user(username, frame)
+                return True
+            return False
+        
+        try:
+            client.send(frame)
+            return True
+        except socket.error:
+            return False
+
+class AsyncConnection:
+    """Клиентское подключение asyncio с ограниченной очередью отправки
+    
+    Кадры пишет отдельная задача: при медленном клиенте она ждет drain(),
+    а новые кадры копятся в очереди с той же политикой, что и у QueuedConnection.
+    Как и QueuedConnection, объект переживает обрыв и продолжает сессию на новом
+    StreamWriter.
+    """
+    def __init__(self, writer, max_queue=MAX_SEND_QUEUE, policy=SLOW_CLIENT_POLICY, replay_size=0,
+                 metrics=None):
+        self.writer = writer
+        self.last_seen = time.monotonic()  # время последних данных от клиента
+        self.queue = SendQueue(max_queue, policy)
+        self.replay = ReplayBuffer(replay_size)
+        self.ready = asyncio.Event()
+        self.closing = False
+        self.compressor = None  # сжатие потока, если клиент его запросил
+        self.sending_started = False
+        self.metrics = metrics
+        self.start_writer()
+    
+    def start_writer(self):
+        self.writer_task = asyncio.get_running_loop().create_task(self.write_loop(self.writer))
+    
+    def send(self, data):
+        """Постановка кадра в очередь отправки"""
+        if self.closing:
+            raise ConnectionResetError("Соединение закрыто")
+        if not self.queue.put(data):
+            self.abort()
+            raise ConnectionResetError("Очередь отправки переполнена")
+        self.sending_started = True
+        self.ready.set()
+    
+    def enable_compression(self):
+        """Включение сжатия потока; возможно только до первого кадра клиенту"""
+        if self.sending_started:
+            return False
+        self.compressor = FrameCompressor()
+        return True
+    
+    async def write_loop(self, writer):
+        """Задача-писатель: отправляет накопленные кадры в writer, пока сессия к нему привязана"""
+        try:
+            while True:
+                await self.ready.wait()
+                if self.writer is not writer:
+                    break
+                self.ready.clear()
+                if self.queue.frames:
+                    batch = self.queue.take_all()
+                    frames = self.replay.record(batch)
+                    if self.compressor is not None:
+                        batch = self.compressor.compress(batch)
+                    writer.write(batch)
+                    if self.metrics is not None:
+                        self.metrics.record_sent(frames, len(batch))
+                    await writer.drain()
+                if self.closing and not self.queue.frames:
+                    break
+        except (ConnectionError, OSError):
+            # обрыв: цикл чтения увидит закрытое соединение
+            writer.transport.abort()
+        finally:
+            if self.writer is writer:
+                writer.close()
+    
+    def owns(self, writer):
+        return self.writer is writer
+    
+    def attached(self):
+        return self.writer is not None
+    
+    def release(self):
+        """Передача соединения другой сессии (при переподключении): задача записи завершается"""
+        writer = self.writer
+        self.writer = None
+        self.ready.set()
+        return writer
+    
+    def detach(self, writer):
+        """Отвязка сессии от оборванного соединения writer
+        
+        Возвращает False, если сессия уже продолжена на другом соединении.
+        """
+        if self.writer is not writer:
             return False
+        self.writer = None
+        self.ready.set()
+        writer.close()
+        return True
+    
+    def attach(self, writer, seq, compressor=None):
+        """Привязка сессии к новому соединению; пропущенные клиентом кадры ставятся в начало очереди
+        
+        Возвращает (прежний StreamWriter или None, номер, после которого идет повтор, полный ли повтор).
+        Запись начинается после resume().
+        """
+        old_writer = self.writer
+        data, seq, complete = self.replay.take_since(seq)
+        if data:
+            self.queue.frames.appendleft(data)
+        self.writer = writer
+        self.compressor = compressor
+        self.last_seen = time.monotonic()
+        self.ready.set()
+        return old_writer, seq, complete
+    
+    def resume(self, frame):
+        """Запуск записи после attach(): первым уходит кадр подтверждения (он не нумеруется)"""
+        if self.compressor is not None:
+            frame = self.compressor.compress(frame)
+        self.writer.write(frame)
+        self.start_writer()
+        self.ready.set()
+    
+    def interrupt(self):
+        """Разрыв текущего соединения без закрытия сессии"""
+        if self.writer is not None:
+            self.writer.transport.abort()
+    
+    def close(self):
+        """Закрытие после отправки уже поставленных в очередь кадров"""
+        self.closing = True
+        self.ready.set()
+    
+    def abort(self):
+        """Немедленный разрыв соединения"""
+        self.closing = True
+        self.queue.frames.clear()
+        self.interrupt()
+        self.ready.set()
+
+class AsyncChatServer(ChatServer):
+    """Чат-сервер на asyncio: все подключения обслуживаются одним циклом событий"""
+    def __init__(self, host, port, **kwargs):
+        super().__init__(host, port, **kwargs)
+        self.server = None
+        self.loop = None
+    
+    def run_in_server(self, callback, *args):
+        """Передача вызова из потока шины в цикл событий"""
+        self.loop.call_soon_threadsafe(callback, *args)
+    
+    def start(self):
+        """Запуск чат-сервера"""
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            print(f"Ошибка запуска сервера: {e}")
+        finally:
+            self.stop()
+    
+    async def serve(self):
+        """Основной цикл событий сервера"""
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port,
+            reuse_address=True, reuse_port=self.reuse_port, backlog=BACKLOG
+        )
+        self.connect_bus()
+        self.running = True
+        self.start_metrics()
+        timer_task = self.loop.create_task(self.timer_loop())
+        
+        print(f"Многопользовательский чат-сервер (asyncio) запущен на {self.host}:{self.port}")
+        print("Ожидание подключений клиентов...")
+        print("Для остановки сервера нажмите Ctrl+C")
+        
+        async with self.server:
+            try:
+                await self.server.serve_forever()
+            except asyncio.CancelledError:
+                # сервер закрыт через stop()
+                pass
+        timer_task.cancel()
+    
+    async def timer_loop(self):
+        """Задача таймеров: одна на все соединения и комнаты"""
+        while self.running:
+            await asyncio.sleep(self.timers.tick)
+            self.run_timers()
+    
+    async def register_client(self, client, client_address, username_data):
+        """Регистрация клиента (см. ChatServer.register_client)
+        
+        Ответа шины на резервирование имени ждет только эта сопрограмма,
+        остальные подключения процесса в это время обслуживаются.
+        """
+        username, session, compressed = self.parse_greeting(client, client_address, username_data)
+        if session is not None:
+            return True, username, session
+        
+        accepted = self.reserve_username(client, client_address, username)
+        if accepted and self.bus is not None and not await self.bus.claim_user_async(username):
+            self.release_username(client, username)
+            accepted = False
+        return self.finish_registration(client, client_address, username, compressed, accepted)
+    
+    async def handle_connection(self, reader, writer):
+        """Обработка клиентского подключения в виде сопрограммы"""
+        client = AsyncConnection(writer, self.max_send_queue, self.slow_client_policy,
+                                 self.resume_buffer, self.metrics)
+        self.watch_connection(client)
+        if self.metrics is not None:
+            self.metrics.connections.inc()
+        client_address = writer.get_extra_info('peername')
+        username = None
+        decoder = FrameDecoder()
+        print(f"Новое подключение от {client_address}")
+        
+        try:
+            # основной цикл получения сообщений от клиента
+            while self.running:
+                data = await reader.read(RECV_SIZE)
+                if not data:
+                    break
+                client.last_seen = time.monotonic()
+                if self.metrics is not None:
+                    self.metrics.bytes_received.inc(len(data))
+                
+                for frame in decoder.feed(data):
+                    if username is None:
+                        # первое сообщение - имя пользователя или возобновление сессии
+                        registered, username, client = await self.register_client(client, client_address, frame)
+                        if not registered:
+                            return
+                    else:
+                        self.process_message(client, username, frame)
+                
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except FrameTooLargeError as e:
+            print(f"Слишком большое сообщение от {username or client_address}: {e}")
+        except Exception as e:
+            print(f"Ошибка обработки клиента {username or client_address}: {e}")
+        
+        finally:
+            self.release_client(client, writer)
+    
+    def close_handle(self, writer):
+        """Закрытие соединения, которое больше не принадлежит сессии"""
+        writer.transport.abort()
+    
+    def stop(self):
+        """Остановка чат-сервера"""
+        if self.server:
+            self.server.close()
+        super().stop()
+
+def parse_rate_limit(value):
+    """Разбор параметра --rate-limit вида ТИП=СООБЩЕНИЙ_В_СЕКУНДУ:ЗАПАС"""
+    try:
+        message_type, limit = value.split('=', 1)
+        rate, burst = limit.split(':', 1)
+        return message_type, (float(rate), int(burst))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ожидается ТИП=СООБЩЕНИЙ_В_СЕКУНДУ:ЗАПАС, получено {value!r}")
+
+def run_worker(server_class, host, port, options):
+    """Рабочий процесс: отдельный сервер на общем порту"""
+    chat_server = server_class(host, port, reuse_port=True, **options)
+    try:
+        chat_server.start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        chat_server.stop()
+
+def run_cluster(server_class, host, port, workers, options):
+    """Запуск нескольких рабочих процессов с общим портом и шиной сообщений между ними"""
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        print("SO_REUSEPORT не поддерживается этой платформой")
+        return
+    
+    bus_path = os.path.join(tempfile.mkdtemp(prefix='chat-bus-'), 'bus.sock')
+    log_dir = options.get('log_dir')
+    bus = MessageBus(bus_path, ChatLog(log_dir, options['log_fsync']) if log_dir else None)
+    bus.start()
+    options = dict(options, bus_path=bus_path)
+    
+    processes = []
+    for index in range(workers):
+        # у каждого процесса свои метрики и свой порт: metrics_port, metrics_port + 1, ...
+        worker_options = options
+        if options.get('metrics_port'):
+            worker_options = dict(options, metrics_port=options['metrics_port'] + index)
+        processes.append(multiprocessing.Process(target=run_worker, args=(server_class, host, port, worker_options)))
+    for process in processes:
+        process.start()
+    print(f"Запущено рабочих процессов: {workers} (шина сообщений: {bus_path})")
+    
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print("\nПолучен сигнал остановки...")
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        bus.stop()
+        os.rmdir(os.path.dirname(bus_path))
 
 def main():
     """Основная функция"""
-    chat_server = ChatServer(HOST, PORT)
+    parser = argparse.ArgumentParser(description="Многопользовательский чат-сервер")
+    parser.add_argument('--host', default=HOST, help="адрес сервера")
+    parser.add_argument('--port', type=int, default=PORT, help="порт сервера")
+    parser.add_argument('--mode', choices=('threads', 'async'), default='threads',
+                        help="threads - поток на клиента, async - один цикл событий asyncio")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="число рабочих процессов на общем порту (SO_REUSEPORT)")
+    parser.add_argument('--history', type=int, default=HISTORY_SIZE,
+                        help="число последних сообщений, которые хранит каждая комната")
+    parser.add_argument('--log-dir', default=None,
+                        help="каталог журнала сообщений на диске (по умолчанию журнал не ведется)")
+    parser.add_argument('--log-fsync', type=float, default=LOG_FSYNC_INTERVAL,
+                        help="секунд между fsync журнала: 0 - после каждой пачки, < 0 - не вызывать fsync")
+    parser.add_argument('--heartbeat', type=float, default=HEARTBEAT_INTERVAL,
+                        help="секунд простоя до ping клиенту (0 - без проверки активности)")
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help="секунд без данных от клиента до разрыва соединения")
+    parser.add_argument('--rate-limit', type=parse_rate_limit, action='append', default=[],
+                        metavar='ТИП=RATE:BURST',
+                        help="лимит частоты для типа сообщения ('*' - общий лимит), можно повторять")
+    parser.add_argument('--no-rate-limit', action='store_true', help="отключить ограничение частоты")
+    parser.add_argument('--no-compression', action='store_true',
+                        help="не сжимать поток, даже если клиент просит")
+    parser.add_argument('--presence-window', type=float, default=PRESENCE_WINDOW,
+                        help="секунд накопления входов/выходов в одно presence_delta (0 - сразу)")
+    parser.add_argument('--resume-timeout', type=float, default=RESUME_TIMEOUT,
+                        help="секунд ожидания переподключения оборвавшегося клиента (0 - без возобновления)")
+    parser.add_argument('--resume-buffer', type=int, default=RESUME_BUFFER,
+                        help="байт последних кадров клиента для повтора после переподключения")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="локальный порт метрик Prometheus (GET /metrics); с --workers - по порту на процесс")
+    parser.add_argument('--send-queue', type=int, default=MAX_SEND_QUEUE,
+                        help="максимальное число неотправленных кадров на клиента")
+    parser.add_argument('--slow-client', choices=SLOW_CLIENT_POLICIES, default=SLOW_CLIENT_POLICY,
+                        help="drop_oldest - выбрасывать старые кадры, disconnect - отключать клиента")
+    args = parser.parse_args()
+    
+    server_class = AsyncChatServer if args.mode == 'async' else ChatServer
+    rate_limits = {} if args.no_rate_limit else dict(RATE_LIMITS, **dict(args.rate_limit))
+    options = {
+        'max_send_queue': args.send_queue,
+        'slow_client_policy': args.slow_client,
+        'history_size': args.history,
+        'log_dir': args.log_dir,
+        'log_fsync': args.log_fsync,
+        'heartbeat_interval': args.heartbeat,
+        'idle_timeout': args.idle_timeout,
+        'rate_limits': rate_limits,
+        'compression': not args.no_compression,
+        'presence_window': args.presence_window,
+        'resume_timeout': args.resume_timeout,
+        'resume_buffer': args.resume_buffer,
+        'metrics_port': args.metrics_port,
+    }
+    
+    if args.workers > 1:
+        run_cluster(server_class, args.host, args.port, args.workers, options)
+        return
+    
+    chat_server = server_class(args.host, args.port, **options)
     
     try:
         chat_server.start()
@@ -0,0 +1,66 @@
+import math
+import threading
+import time
+
+TIMER_TICK = 0.5  # шаг колеса таймеров в секундах
+TIMER_SLOTS = 512  # число ячеек колеса (один оборот - TIMER_TICK * TIMER_SLOTS секунд)
+
+class TimerWheel:
+    """Колесо таймеров для всех соединений сервера
+
+    Таймер кладется в ячейку, до которой колесо дойдет через нужное число шагов;
+    постановка и отмена стоят O(1), а обслуживает все таймеры один поток
+    (или одна задача asyncio), периодически вызывающий advance().
+    Таймеры длиннее оборота колеса пропускают нужное число оборотов.
+    """
+    def __init__(self, tick=TIMER_TICK, slots=TIMER_SLOTS):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]  # ячейки {key: (оставшиеся обороты, callback)}
+        self.timers = {}  # {key: номер ячейки}
+        self.position = 0
+        self.last_tick = time.monotonic()
+        self.lock = threading.Lock()
+
+    def schedule(self, key, delay, callback):
+        """Постановка таймера key через delay секунд (старый таймер key отменяется)"""
+        ticks = max(1, math.ceil(delay / self.tick))
+        with self.lock:
+            self.remove(key)
+            slot = (self.position + ticks) % len(self.slots)
+            self.slots[slot][key] = ((ticks - 1) // len(self.slots), callback)
+            self.timers[key] = slot
+
+    def cancel(self, key):
+        with self.lock:
+            self.remove(key)
+
+    def remove(self, key):
+        # вызывается под self.lock
+        slot = self.timers.pop(key, None)
+        if slot is not None:
+            del self.slots[slot][key]
+
+    def advance(self, now=None):
+        """Поворот колеса до момента now, возвращает [(key, callback)] сработавших таймеров
+
+        Обратные вызовы выполняет вызывающий, уже без блокировки колеса.
+        """
+        if now is None:
+            now = time.monotonic()
+        expired = []
+        with self.lock:
+            while now - self.last_tick >= self.tick:
+                self.last_tick += self.tick
+                self.position = (self.position + 1) % len(self.slots)
+                slot = self.slots[self.position]
+                for key, (rounds, callback) in list(slot.items()):
+                    if rounds:
+                        slot[key] = (rounds - 1, callback)
+                    else:
+                        del slot[key]
+                        del self.timers[key]
+                        expired.append((key, callback))
+        return expired
+
+    def __len__(self):
+        return len(self.timers)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import threading
+import time
+
+from store import GradeStore
+
+SUBJECTS = 50
+DURATION = 2.0
+
+def writer(store, index, stop, counts):
+    added = 0
+    while not stop.is_set():
+        store.add(f"Дисциплина {(index + added) % SUBJECTS}", str(added % 5 + 1))
+        added += 1
+    counts.append(added)
+
+def reader(store, stop, counts, torn):
+    reads = 0
+    while not stop.is_set():
+        snapshot = store.snapshot()
+        # каждая добавленная оценка поднимает версию ровно на 1
+        total = sum(len(values) for _, values in snapshot.items())
+        if total != snapshot.version:
+            torn.append((snapshot.version, total))
+        reads += 1
+    counts.append(reads)
+
+def run(writers, readers, duration):
+    store = GradeStore()
+    stop = threading.Event()
+    added, read, torn = [], [], []
+    threads = [threading.Thread(target=writer, args=(store, i, stop, added)) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(store, stop, read, torn)) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    print(f"писатели: {writers}, читатели: {readers}, {duration:.1f} с")
+    print(f"  добавлено оценок: {sum(added)} ({sum(added) / duration:.0f}/с), версия: {store.version}")
+    print(f"  срезов прочитано: {sum(read)} ({sum(read) / duration:.0f}/с)")
+    print(f"  несогласованных срезов: {len(torn)}")
+    return not torn
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест хранилища оценок без HTTP")
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=DURATION)
+    args = parser.parse_args()
+    if not run(args.writers, args.readers, args.duration):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
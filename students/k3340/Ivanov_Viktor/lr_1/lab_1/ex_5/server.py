@@ -1,48 +1,59 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
+import asyncio
 import socket
 import threading
 import json
-import os
+import gzip
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import parse_qs, urlparse, unquote_plus
 from datetime import datetime
+from storage import GradeStorage
+from store import GradeStore
+from template import Template
 
 HOST = "127.0.0.1"
 PORT = 8082
 STORAGE_FILE = "grades.json"
 TEMPLATE_FILE = "index.html"
+BACKLOG = 1024
+WORKER_THREADS = 4  # потоки для блокирующей работы в режиме --async
+MAX_PENDING = 256  # запросов, ожидающих свободный поток пула
+BLOCKING_ROUTES = {("POST", "/add")}
+KEEP_ALIVE_TIMEOUT = 5.0  # секунд ожидания следующего запроса в постоянном соединении
+MAX_KEEP_ALIVE_REQUESTS = 100  # запросов в одном соединении, после чего оно закрывается
+MAX_HEADER_SIZE = 64 * 1024
+GZIP_MIN_SIZE = 1024  # ответы меньше этого размера не сжимаются
 
-grades = {}
+store = GradeStore()
+storage = GradeStorage(STORAGE_FILE)
+page_template = Template(TEMPLATE_FILE)
+# {путь: [ключ версии, ETag, тело, тело в gzip или None]}: тело собирается один раз
+# на версию хранилища (для / - и на версию шаблона), gzip - при первом запросе с gzip
+response_cache = {}
 
 def load_storage():
-    global grades
-    if os.path.exists(STORAGE_FILE):
-        try:
-            with open(STORAGE_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            grades = {str(k): [str(x) for x in v] for k, v in data.items() if isinstance(v, list)}
-        except Exception:
-            grades = {}
-    else:
-        grades = {}
+    global store
+    store = GradeStore(storage.load())
 
-def save_storage():
-    try:
-        with open(STORAGE_FILE, "w", encoding="utf-8") as f:
-            json.dump(grades, f, ensure_ascii=False, indent=2)
-    except Exception:
-        pass
-
-def http_response(status_code=200, reason="OK", headers=None, body=b""):
+def http_response(status_code=200, reason="OK", headers=None, body=b"", keep_alive=None):
+    # keep_alive - значение заголовка Keep-Alive для постоянного соединения, None - закрыть
     if headers is None:
         headers = {}
     base_headers = {
         "Server": "TinySocketServer/0.2",
         "Content-Length": str(len(body)),
-        "Connection": "close",
+        "Connection": "keep-alive" if keep_alive else "close",
         "Date": datetime.utcnow().strftime("%a, %d %b %Y %H:%M:%S GMT"),
     }
+    if status_code == 304:
+        # у 304 нет тела, а Content-Length описывал бы непереданный ответ 200
+        del base_headers["Content-Length"]
+    if keep_alive:
+        base_headers["Keep-Alive"] = keep_alive
     base_headers.update(headers)
     status_line = f"HTTP/1.1 {status_code} {reason}\r\n"
     header_lines = "".join(f"{k}: {v}\r\n" for k, v in base_headers.items())
@@ -55,42 +66,88 @@ def escape_html(s: str) -> str:
              .replace('"', "&quot;")
              .replace("'", "&#39;"))
 
-def build_table_rows():
-    rows = []
-    for subj in sorted(grades.keys(), key=lambda s: s.lower()):
-        vals = grades[subj]
-        joined = ", ".join(vals) if vals else "—"
-        avg = "—"
-        nums = []
-        for v in vals:
-            try:
-                nums.append(float(v.replace(",", ".")))
-            except ValueError:
-                pass
-        if nums:
-            avg = f"{sum(nums) / len(nums):.2f}"
-        rows.append(
-            f"<tr><td>{escape_html(subj)}</td>"
-            f"<td>{escape_html(joined)}</td>"
-            f"<td>{avg}</td></tr>"
-        )
+# {дисциплина: (сводка, строка таблицы)}: строка пересобирается, только когда
+# у дисциплины появилась новая оценка (то есть сменился объект сводки)
+row_cache = {}
+
+def build_table_row(snapshot, subj):
+    stats = snapshot.stats[subj]
+    cached = row_cache.get(subj)
+    if cached is not None and cached[0] is stats:
+        return cached[1]
+    vals = snapshot.get(subj)
+    joined = ", ".join(vals) if vals else "—"
+    avg = "—" if stats.mean is None else f"{stats.mean:.2f}"
+    row = (
+        f"<tr><td>{escape_html(subj)}</td>"
+        f"<td>{escape_html(joined)}</td>"
+        f"<td>{avg}</td></tr>"
+    )
+    row_cache[subj] = (stats, row)
+    return row
+
+def build_table_rows(snapshot):
+    # дисциплины уже отсортированы и средние посчитаны в хранилище: O(дисциплин)
+    rows = [build_table_row(snapshot, subj) for subj in snapshot.subjects()]
     if not rows:
         rows = ['<tr><td colspan="3" style="text-align:center;color:#666">'
                 'Пока пусто. Добавьте первую оценку ниже 👇</td></tr>']
     return "\n".join(rows)
 
-def render_html_from_file():
+def render_html_from_file(snapshot):
     try:
-        with open(TEMPLATE_FILE, "r", encoding="utf-8") as f:
-            tpl = f.read()
+        return page_template.render(TABLE_ROWS=build_table_rows(snapshot),
+                                    NOW=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
     except FileNotFoundError:
         # fallback: если шаблон потерян
         return "<h1>Шаблон index.html не найден</h1>".encode("utf-8")
 
-    page = (tpl
-            .replace("{{TABLE_ROWS}}", build_table_rows())
-            .replace("{{NOW}}", datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-    return page.encode("utf-8")
+def page_version(snapshot):
+    # страница меняется вместе с оценками и с файлом шаблона
+    try:
+        return snapshot.version, page_template.load()
+    except FileNotFoundError:
+        return snapshot.version, None
+
+def cached_body(path, key, build):
+    # запись кэша для версии key; build() вызывается, только если версия сменилась
+    entry = response_cache.get(path)
+    if entry is None or entry[0] != key:
+        body = build()
+        etag = '"%s"' % hashlib.blake2b(body, digest_size=8).hexdigest()
+        entry = [key, etag, body, None]
+        response_cache[path] = entry
+    return entry
+
+def etag_matches(if_none_match, etags):
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == "*" or tag in etags:
+            return True
+    return False
+
+def cached_response(headers, entry, content_type):
+    # 304 при совпадении If-None-Match, иначе тело из кэша (сжатое, если клиент умеет gzip)
+    _, etag, body, gzipped = entry
+    gzip_etag = etag[:-1] + '-gzip"'
+    use_gzip = len(body) >= GZIP_MIN_SIZE and "gzip" in headers.get("accept-encoding", "").lower()
+    response_headers = {"ETag": gzip_etag if use_gzip else etag, "Cache-Control": "no-cache"}
+    if len(body) >= GZIP_MIN_SIZE:
+        response_headers["Vary"] = "Accept-Encoding"
+    if etag_matches(headers.get("if-none-match"), (etag, gzip_etag)):
+        return 304, "Not Modified", response_headers, b""
+
+    response_headers["Content-Type"] = content_type
+    if use_gzip:
+        if gzipped is None:
+            gzipped = entry[3] = gzip.compress(body, 6)
+        response_headers["Content-Encoding"] = "gzip"
+        body = gzipped
+    return 200, "OK", response_headers, body
 
 def parse_request_line(request_line: str):
     parts = request_line.split()
@@ -101,111 +158,159 @@ def parse_request_line(request_line: str):
         raise ValueError("Unsupported HTTP version")
     return method.upper(), target, version
 
-def handle_client(conn, addr):
+def parse_request_head(header_part: bytes):
     try:
-        request_data = b""
-        while b"\r\n\r\n" not in request_data:
-            chunk = conn.recv(4096)
-            if not chunk:
-                break
-            request_data += chunk
+        header_text = header_part.decode("iso-8859-1", errors="replace")
+    except Exception:
+        header_text = header_part.decode("utf-8", errors="replace")
 
-        if not request_data:
-            conn.sendall(http_response(400, "Bad Request",
-                                       headers={"Content-Type": "text/plain; charset=utf-8"},
-                                       body=b"Bad Request"))
-            return
+    lines = header_text.split("\r\n")
+    request_line = lines[0]
+    method, target, version = parse_request_line(request_line)
 
-        header_part, _, rest = request_data.partition(b"\r\n\r\n")
-        try:
-            header_text = header_part.decode("iso-8859-1", errors="replace")
-        except Exception:
-            header_text = header_part.decode("utf-8", errors="replace")
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        if ":" in line:
+            k, v = line.split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+    return method, target, version, headers
 
-        lines = header_text.split("\r\n")
-        request_line = lines[0]
-        method, target, version = parse_request_line(request_line)
+def parse_content_length(method, headers):
+    # длина тела запроса; ValueError, если у POST нет Content-Length или он не целое >= 0
+    value = headers.get("content-length")
+    if value is None:
+        if method == "POST":
+            raise ValueError("Content-Length required")
+        return 0
+    if not (value.isascii() and value.isdigit()):
+        raise ValueError("Malformed Content-Length")
+    return int(value)
 
-        headers = {}
-        for line in lines[1:]:
-            if not line:
-                continue
-            if ":" in line:
-                k, v = line.split(":", 1)
-                headers[k.strip().lower()] = v.strip()
-
-        body = rest
-        content_length = int(headers.get("content-length", "0") or "0")
-        to_read = max(0, content_length - len(body))
-        while to_read > 0:
-            chunk = conn.recv(min(4096, to_read))
-            if not chunk:
-                break
-            body += chunk
-            to_read -= len(chunk)
-
-        parsed = urlparse(target)
-        path = parsed.path
-
-        # GET /
-        if method == "GET" and path == "/":
-            body_bytes = render_html_from_file()
-            conn.sendall(http_response(200, "OK",
-                                       headers={"Content-Type": "text/html; charset=utf-8"},
-                                       body=body_bytes))
-            return
-
-        # GET /api/grades
-        if method == "GET" and path == "/api/grades":
-            body_bytes = json.dumps(grades, ensure_ascii=False, indent=2).encode("utf-8")
-            conn.sendall(http_response(200, "OK",
-                                       headers={"Content-Type": "application/json; charset=utf-8"},
-                                       body=body_bytes))
-            return
-
-        # POST /add
-        if method == "POST" and path == "/add":
-            ctype = headers.get("content-type", "")
-            payload = body.decode("utf-8", errors="replace")
-            form = parse_qs(payload, keep_blank_values=True) if "application/x-www-form-urlencoded" in ctype else parse_qs(payload, keep_blank_values=True)
-
-            subject = unquote_plus(form.get("subject", [""])[0].strip())
-            grade = unquote_plus(form.get("grade", [""])[0].strip())
-
-            if not subject or not grade:
-                msg = "Both 'subject' and 'grade' are required."
-                conn.sendall(http_response(400, "Bad Request",
-                                           headers={"Content-Type": "text/plain; charset=utf-8"},
-                                           body=msg.encode("utf-8")))
+def is_blocking_request(method, target):
+    # запросы с записью на диск уходят в пул потоков, остальные обслуживает цикл событий
+    return (method, urlparse(target).path) in BLOCKING_ROUTES
+
+def handle_request(method, target, headers, body):
+    # возвращает (код, причина, заголовки, тело); заголовок Connection добавляет вызывающий
+    parsed = urlparse(target)
+    path = parsed.path
+
+    # GET /
+    if method == "GET" and path == "/":
+        snapshot = store.snapshot()
+        entry = cached_body(path, page_version(snapshot), lambda: render_html_from_file(snapshot))
+        return cached_response(headers, entry, "text/html; charset=utf-8")
+
+    # GET /api/grades
+    if method == "GET" and path == "/api/grades":
+        snapshot = store.snapshot()
+        entry = cached_body(path, snapshot.version,
+                            lambda: json.dumps(snapshot.to_dict(), ensure_ascii=False, indent=2).encode("utf-8"))
+        return cached_response(headers, entry, "application/json; charset=utf-8")
+
+    # POST /add
+    if method == "POST" and path == "/add":
+        ctype = headers.get("content-type", "")
+        payload = body.decode("utf-8", errors="replace")
+        form = parse_qs(payload, keep_blank_values=True) if "application/x-www-form-urlencoded" in ctype else parse_qs(payload, keep_blank_values=True)
+
+        subject = unquote_plus(form.get("subject", [""])[0].strip())
+        grade = unquote_plus(form.get("grade", [""])[0].strip())
+
+        if not subject or not grade:
+            msg = "Both 'subject' and 'grade' are required."
+            return 400, "Bad Request", {"Content-Type": "text/plain; charset=utf-8"}, msg.encode("utf-8")
+
+        # сначала журнал на диске, потом память: ответ 303 значит, что оценка сохранена
+        storage.append(subject, grade)
+        store.add(subject, grade)
+
+        # redirect back to /
+        return 303, "See Other", {"Location": "/", "Content-Type": "text/plain; charset=utf-8"}, b"See Other"
+
+    # unsupported
+    if method not in ("GET", "POST"):
+        return (405, "Method Not Allowed",
+                {"Content-Type": "text/plain; charset=utf-8", "Allow": "GET, POST"},
+                b"Method Not Allowed")
+
+    return 404, "Not Found", {"Content-Type": "text/plain; charset=utf-8"}, b"Not Found"
+
+def bad_request():
+    return http_response(400, "Bad Request",
+                         headers={"Content-Type": "text/plain; charset=utf-8"},
+                         body=b"Bad Request")
+
+def internal_error(e):
+    return http_response(500, "Internal Server Error",
+                         headers={"Content-Type": "text/plain; charset=utf-8"},
+                         body=f"Internal Server Error: {e}".encode("utf-8"))
+
+def keep_alive_value(version, headers, served, keep_alive_timeout, max_requests):
+    # значение заголовка Keep-Alive, если соединение можно оставить открытым, иначе None
+    connection = headers.get("connection", "").lower()
+    if version == "HTTP/1.0":
+        persistent = "keep-alive" in connection
+    else:
+        persistent = "close" not in connection
+    remaining = max_requests - served
+    if not persistent or remaining <= 0 or keep_alive_timeout <= 0:
+        return None
+    return f"timeout={int(keep_alive_timeout)}, max={remaining}"
+
+def handle_client(conn, addr, keep_alive_timeout=KEEP_ALIVE_TIMEOUT, max_requests=MAX_KEEP_ALIVE_REQUESTS):
+    # запросы соединения обрабатываются по очереди; данные следующего запроса,
+    # пришедшие вместе с текущим (pipelining), остаются в buffer
+    buffer = b""
+    served = 0
+    if keep_alive_timeout > 0:
+        conn.settimeout(keep_alive_timeout)
+    try:
+        while True:
+            while b"\r\n\r\n" not in buffer and len(buffer) <= MAX_HEADER_SIZE:
+                try:
+                    chunk = conn.recv(4096)
+                except socket.timeout:
+                    # простой дольше keep_alive_timeout: соединение закрывается без ответа
+                    return
+                if not chunk:
+                    break
+                buffer += chunk
+
+            if not buffer.strip():
+                if not served:
+                    conn.sendall(bad_request())
+                return
+            if len(buffer) > MAX_HEADER_SIZE and b"\r\n\r\n" not in buffer:
+                conn.sendall(bad_request())
+                return
+
+            header_part, _, buffer = buffer.partition(b"\r\n\r\n")
+            try:
+                method, target, version, headers = parse_request_head(header_part.lstrip(b"\r\n"))
+                content_length = parse_content_length(method, headers)
+            except ValueError:
+                # границу следующего запроса уже не найти: ответ 400 и закрытие
+                conn.sendall(bad_request())
                 return
 
-            if subject not in grades:
-                grades[subject] = []
-            grades[subject].append(grade)
-            save_storage()
-
-            # redirect back to /
-            conn.sendall(http_response(303, "See Other",
-                                       headers={"Location": "/", "Content-Type": "text/plain; charset=utf-8"},
-                                       body=b"See Other"))
-            return
-
-        # unsupported
-        if method not in ("GET", "POST"):
-            conn.sendall(http_response(405, "Method Not Allowed",
-                                       headers={"Content-Type": "text/plain; charset=utf-8",
-                                                "Allow": "GET, POST"},
-                                       body=b"Method Not Allowed"))
-            return
-
-        conn.sendall(http_response(404, "Not Found",
-                                   headers={"Content-Type": "text/plain; charset=utf-8"},
-                                   body=b"Not Found"))
+            while len(buffer) < content_length:
+                chunk = conn.recv(min(4096, content_length - len(buffer)))
+                if not chunk:
+                    break
+                buffer += chunk
+            body, buffer = buffer[:content_length], buffer[content_length:]
+
+            served += 1
+            keep_alive = keep_alive_value(version, headers, served, keep_alive_timeout, max_requests)
+            conn.sendall(http_response(*handle_request(method, target, headers, body), keep_alive=keep_alive))
+            if not keep_alive:
+                return
     except Exception as e:
         try:
-            conn.sendall(http_response(500, "Internal Server Error",
-                                       headers={"Content-Type": "text/plain; charset=utf-8"},
-                                       body=f"Internal Server Error: {e}".encode("utf-8")))
+            conn.sendall(internal_error(e))
         except Exception:
             pass
     finally:
@@ -215,7 +320,98 @@ def handle_client(conn, addr):
             pass
         conn.close()
 
-def serve():
+async def read_request(reader, keep_alive_timeout):
+    # (заголовки, тело) очередного запроса соединения или None, если клиент закрыл соединение;
+    # пустые заголовки - запрос не разобран (ответ 400); простой дольше keep_alive_timeout - asyncio.TimeoutError
+    try:
+        header_part = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"),
+                                             keep_alive_timeout if keep_alive_timeout > 0 else None)
+        header_part = header_part[:-4].lstrip(b"\r\n")
+    except asyncio.IncompleteReadError as e:
+        # клиент закрыл соединение, не дослав заголовки
+        header_part = e.partial
+        if not header_part.strip():
+            return None
+    except asyncio.LimitOverrunError:
+        return b"", b""
+
+    try:
+        method, target, version, headers = parse_request_head(header_part)
+        content_length = parse_content_length(method, headers)
+    except ValueError:
+        # как и переполнение заголовков: вызывающий ответит 400
+        return b"", b""
+    body = b""
+    if content_length > 0:
+        try:
+            body = await asyncio.wait_for(reader.readexactly(content_length),
+                                          keep_alive_timeout if keep_alive_timeout > 0 else None)
+        except asyncio.IncompleteReadError as e:
+            body = e.partial
+    return (method, target, version, headers), body
+
+async def handle_connection(reader, writer, pool, pending,
+                            keep_alive_timeout=KEEP_ALIVE_TIMEOUT, max_requests=MAX_KEEP_ALIVE_REQUESTS):
+    # StreamReader сам буферизует пришедшие заранее запросы (pipelining), ответы уходят по порядку
+    served = 0
+    try:
+        while True:
+            try:
+                request = await read_request(reader, keep_alive_timeout)
+                if request is None:
+                    if not served:
+                        writer.write(bad_request())
+                    break
+                head, body = request
+                if not head:
+                    writer.write(bad_request())
+                    break
+                method, target, version, headers = head
+
+                served += 1
+                keep_alive = keep_alive_value(version, headers, served, keep_alive_timeout, max_requests)
+                if is_blocking_request(method, target):
+                    # пул ограничен, а число ожидающих его задач - семафором
+                    async with pending:
+                        loop = asyncio.get_running_loop()
+                        result = await loop.run_in_executor(pool, handle_request, method, target, headers, body)
+                else:
+                    result = handle_request(method, target, headers, body)
+            except asyncio.TimeoutError:
+                break
+            except Exception as e:
+                writer.write(internal_error(e))
+                break
+
+            writer.write(http_response(*result, keep_alive=keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+        await writer.drain()
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        writer.close()
+
+async def serve_forever_async(workers, keep_alive_timeout=KEEP_ALIVE_TIMEOUT, max_requests=MAX_KEEP_ALIVE_REQUESTS):
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="grades-worker")
+    pending = asyncio.Semaphore(MAX_PENDING)
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(reader, writer, pool, pending, keep_alive_timeout, max_requests),
+        HOST, PORT, reuse_address=True, backlog=BACKLOG
+    )
+    print(f"Serving on http://{HOST}:{PORT} (asyncio, {workers} worker threads) …")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        pool.shutdown(wait=True)
+
+def serve_async(workers=WORKER_THREADS, keep_alive_timeout=KEEP_ALIVE_TIMEOUT, max_requests=MAX_KEEP_ALIVE_REQUESTS):
+    load_storage()
+    asyncio.run(serve_forever_async(workers, keep_alive_timeout, max_requests))
+
+def serve(keep_alive_timeout=KEEP_ALIVE_TIMEOUT, max_requests=MAX_KEEP_ALIVE_REQUESTS):
     load_storage()
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -224,7 +420,25 @@ def serve():
         print(f"Serving on http://{HOST}:{PORT} …")
         while True:
             conn, addr = s.accept()
-            threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
+            threading.Thread(target=handle_client, args=(conn, addr, keep_alive_timeout, max_requests),
+                             daemon=True).start()
+
+def main():
+    parser = argparse.ArgumentParser(description="Веб-сервер журнала оценок")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="один цикл событий asyncio вместо потока на подключение")
+    parser.add_argument("--workers", type=int, default=WORKER_THREADS,
+                        help="размер пула потоков для блокирующей работы (только с --async)")
+    parser.add_argument("--keep-alive-timeout", type=float, default=KEEP_ALIVE_TIMEOUT,
+                        help="секунд ожидания следующего запроса в соединении (0 - закрывать после ответа)")
+    parser.add_argument("--max-requests", type=int, default=MAX_KEEP_ALIVE_REQUESTS,
+                        help="максимум запросов в одном соединении")
+    args = parser.parse_args()
+
+    if args.use_async:
+        serve_async(args.workers, args.keep_alive_timeout, args.max_requests)
+    else:
+        serve(args.keep_alive_timeout, args.max_requests)
 
 if __name__ == "__main__":
-    serve()
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+import time
+
+COMPACT_EVERY = 1000  # записей в журнале, после которых он сворачивается в снимок
+COMPACT_RETRY_DELAY = 5.0  # секунд до повтора неудавшейся свертки
+
+
+class CommitBatch:
+    # пачка записей, которые станут надежными одним fsync
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+# снимок grades.json + журнал добавлений grades.json.wal
+# POST /add дописывает в журнал одну строку вместо перезаписи всего файла,
+# одновременные записи пишет один поток с общим fsync (group commit).
+# журнал из compact_every записей сворачивается в новый снимок в фоне:
+# временный файл + os.replace. у записей есть номера, снимок помнит номер
+# последней учтенной, поэтому сбой на любом шаге не теряет и не дублирует оценки
+class GradeStorage:
+    def __init__(self, path, compact_every=COMPACT_EVERY):
+        self.path = path
+        self.wal_path = path + ".wal"
+        self.old_wal_path = path + ".wal.old"  # журнал, который сейчас сворачивается
+        self.compact_every = compact_every
+        self.seq = 0  # номер последней записи
+        self.wal = None
+        self.wal_records = 0
+        self.pending = []
+        self.batch = CommitBatch()
+        self.condition = threading.Condition()
+        self.compacting = False
+        self.compact_retry_at = 0.0  # monotonic-время, раньше которого свертку не повторяем
+        self.closing = False
+        self.writer_thread = None
+
+    def load(self):
+        # снимок + журналы; недописанная последняя строка журнала отбрасывается
+        snapshot_seq, grades = self.read_snapshot()
+        self.seq = snapshot_seq
+        if os.path.exists(self.old_wal_path):
+            # сбой во время свертки: доделываем ее до начала работы
+            self.seq = max(self.seq, self.replay(self.old_wal_path, snapshot_seq, grades))
+            self.write_snapshot(grades, self.seq)
+            os.unlink(self.old_wal_path)
+            snapshot_seq = self.seq
+        self.seq = max(self.seq, self.replay(self.wal_path, snapshot_seq, grades, truncate=True))
+
+        self.wal = open(self.wal_path, "ab")
+        self.writer_thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer_thread.start()
+        return grades
+
+    def read_snapshot(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return 0, {}
+        if isinstance(data, dict) and isinstance(data.get("grades"), dict):
+            seq, data = data.get("seq", 0), data["grades"]
+        else:
+            # старый формат: просто {дисциплина: [оценки]}
+            seq = 0
+        grades = {str(k): [str(x) for x in v] for k, v in data.items() if isinstance(v, list)}
+        return seq if isinstance(seq, int) else 0, grades
+
+    def replay(self, wal_path, after_seq, grades, truncate=False):
+        # применяет записи журнала с номерами больше after_seq, возвращает номер последней
+        last_seq = 0
+        valid_size = 0
+        try:
+            with open(wal_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+                seq, subject, grade = record["seq"], str(record["subject"]), str(record["grade"])
+            except (ValueError, KeyError, TypeError):
+                break
+            valid_size += len(line)
+            last_seq = seq
+            if seq > after_seq:
+                grades.setdefault(subject, []).append(grade)
+                self.wal_records += truncate
+        if truncate and valid_size < len(data):
+            with open(wal_path, "r+b") as f:
+                f.truncate(valid_size)
+        return last_seq
+
+    def write_snapshot(self, grades, seq):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"seq": seq, "grades": grades}, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.fsync_directory()
+
+    def fsync_directory(self):
+        # переименование надежно только после fsync каталога
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def append(self, subject, grade):
+        # возвращается, когда запись надежно на диске; ошибка записи - OSError
+        with self.condition:
+            if self.closing:
+                raise OSError("Хранилище закрыто")
+            self.seq += 1
+            record = {"seq": self.seq, "subject": subject, "grade": grade}
+            self.pending.append(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+            batch = self.batch
+            self.condition.notify()
+        batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+
+    def write_loop(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closing:
+                    self.condition.wait()
+                if not self.pending:
+                    break
+                lines, self.pending = self.pending, []
+                batch, self.batch = self.batch, CommitBatch()
+
+            # одна запись и один fsync на всех, кто ждал в этой пачке
+            try:
+                self.wal.write(b"".join(lines))
+                self.wal.flush()
+                os.fsync(self.wal.fileno())
+                self.wal_records += len(lines)
+            except OSError as e:
+                batch.error = e
+            batch.done.set()
+
+            if (self.wal_records >= self.compact_every and not self.compacting
+                    and time.monotonic() >= self.compact_retry_at):
+                try:
+                    self.start_compaction()
+                except OSError as e:
+                    self.compaction_failed(e)
+
+        self.wal.close()
+
+    def start_compaction(self):
+        # вызывается из потока записи: новые записи идут в свежий журнал
+        if os.path.exists(self.old_wal_path):
+            # прошлая свертка не доделана: сначала сворачиваем оставшийся журнал,
+            # текущий повернется при следующей записи
+            print(f"Повтор незавершенной свертки журнала оценок: {self.old_wal_path}")
+        else:
+            try:
+                self.wal.close()
+                os.replace(self.wal_path, self.old_wal_path)
+            finally:
+                self.wal = open(self.wal_path, "ab")
+            self.wal_records = 0
+        self.compacting = True
+        threading.Thread(target=self.compact, daemon=True).start()
+
+    def compact(self):
+        try:
+            snapshot_seq, grades = self.read_snapshot()
+            seq = self.replay(self.old_wal_path, snapshot_seq, grades)
+            self.write_snapshot(grades, max(seq, snapshot_seq))
+            os.unlink(self.old_wal_path)
+        except Exception as e:
+            # .wal.old остается на диске: его доделает следующая попытка или load()
+            self.compaction_failed(e)
+        finally:
+            self.compacting = False
+
+    def compaction_failed(self, error):
+        print(f"Ошибка свертки журнала оценок: {error}, повтор через {COMPACT_RETRY_DELAY:g} с")
+        self.compact_retry_at = time.monotonic() + COMPACT_RETRY_DELAY
+
+    def close(self):
+        with self.condition:
+            self.closing = True
+            self.condition.notify()
+        if self.writer_thread is not None:
+            self.writer_thread.join()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import threading
+from bisect import bisect_left, insort
+
+
+def parse_grade(grade):
+    # числовое значение оценки ("4,5" тоже число) или None
+    try:
+        value = float(grade.replace(",", "."))
+    except ValueError:
+        return None
+    return value if math.isfinite(value) else None
+
+
+# сводка по дисциплине, пересчитывается за O(1) при каждой новой оценке
+# (медиана - за O(log n) поиска по отсортированному списку чисел)
+class SubjectStats:
+    __slots__ = ("count", "numeric", "total", "minimum", "maximum", "median")
+
+    def __init__(self, count=0, numeric=0, total=0.0, minimum=None, maximum=None, median=None):
+        self.count = count  # всего оценок
+        self.numeric = numeric  # из них числовых
+        self.total = total
+        self.minimum = minimum
+        self.maximum = maximum
+        self.median = median
+
+    @property
+    def mean(self):
+        return self.total / self.numeric if self.numeric else None
+
+    def added(self, value, numbers):
+        # новая сводка после оценки value (None - не число); numbers уже содержит value
+        if value is None:
+            return SubjectStats(self.count + 1, self.numeric, self.total,
+                                self.minimum, self.maximum, self.median)
+        middle = len(numbers) // 2
+        median = numbers[middle] if len(numbers) % 2 else (numbers[middle - 1] + numbers[middle]) / 2
+        return SubjectStats(self.count + 1, self.numeric + 1, self.total + value,
+                            value if self.minimum is None else min(self.minimum, value),
+                            value if self.maximum is None else max(self.maximum, value),
+                            median)
+
+
+# неизменяемый срез журнала оценок на момент одной версии
+# списки оценок общие с хранилищем и только растут, а срез помнит их длины
+# (в сводках), поэтому чтение не копирует оценки и не видит записи, сделанные
+# после среза. дисциплины в срезе уже отсортированы без учета регистра
+class GradeSnapshot:
+    __slots__ = ("version", "lists", "stats", "order")
+
+    def __init__(self, version, lists, stats, order):
+        self.version = version
+        self.lists = lists
+        self.stats = stats  # {дисциплина: SubjectStats}
+        self.order = order  # кортеж дисциплин в порядке вывода
+
+    def __len__(self):
+        return len(self.order)
+
+    def subjects(self):
+        return self.order
+
+    def get(self, subject):
+        stats = self.stats.get(subject)
+        if stats is None:
+            return []
+        return self.lists[subject][:stats.count]
+
+    def items(self):
+        for subject in self.order:
+            yield subject, self.lists[subject][:self.stats[subject].count]
+
+    def to_dict(self):
+        return dict(self.items())
+
+
+# потокобезопасное хранилище оценок с копированием при записи
+# читатели берут текущий срез одним чтением атрибута и никогда не ждут блокировку,
+# писатели сериализуются короткой блокировкой и публикуют новый срез: копируется
+# только словарь сводок (O(дисциплин)), сами оценки дописываются в конец списков,
+# а порядок дисциплин пересобирается только при появлении новой
+class GradeStore:
+    def __init__(self, grades=None):
+        self.lock = threading.Lock()
+        self.lists = {}
+        self.numbers = {}  # {дисциплина: отсортированные числовые оценки}
+        self.keys = []  # ключи сортировки дисциплин, параллельно order
+        stats, order = {}, ()
+        for subject, values in (grades or {}).items():
+            for grade in values:
+                order = self.apply(subject, grade, stats, order)
+        self.current = GradeSnapshot(0, self.lists, stats, order)
+
+    def snapshot(self):
+        return self.current
+
+    @property
+    def version(self):
+        return self.current.version
+
+    def add(self, subject, grade):
+        # возвращает версию, в которой появилась оценка
+        with self.lock:
+            snapshot = self.current
+            stats = dict(snapshot.stats)
+            order = self.apply(subject, grade, stats, snapshot.order)
+            self.current = GradeSnapshot(snapshot.version + 1, self.lists, stats, order)
+            return self.current.version
+
+    def apply(self, subject, grade, stats, order):
+        # дописывает оценку и обновляет сводку в stats, возвращает порядок дисциплин
+        values = self.lists.get(subject)
+        if values is None:
+            values = self.lists[subject] = []
+            self.numbers[subject] = []
+            key = (subject.lower(), subject)
+            index = bisect_left(self.keys, key)
+            self.keys.insert(index, key)
+            order = order[:index] + (subject,) + order[index:]
+            stats[subject] = SubjectStats()
+        values.append(grade)
+        numbers = self.numbers[subject]
+        value = parse_grade(grade)
+        if value is not None:
+            insort(numbers, value)
+        stats[subject] = stats[subject].added(value, numbers)
+        return order
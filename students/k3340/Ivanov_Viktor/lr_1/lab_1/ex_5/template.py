@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+
+PLACEHOLDER = re.compile(r"\{\{([A-Z_][A-Z0-9_]*)\}\}")
+
+
+def compile_template(text):
+    # текст шаблона -> кортеж частей: bytes - готовый кусок, str - имя подстановки
+    parts = []
+    position = 0
+    for match in PLACEHOLDER.finditer(text):
+        if match.start() > position:
+            parts.append(text[position:match.start()].encode("utf-8"))
+        parts.append(match.group(1))
+        position = match.end()
+    if position < len(text):
+        parts.append(text[position:].encode("utf-8"))
+    return tuple(parts)
+
+
+# шаблон с подстановками {{NAME}}, разобранный один раз
+# файл перечитывается, только если у него сменилось время изменения или размер,
+# отрисовка - склейка заранее закодированных кусков с закодированными значениями
+class Template:
+    def __init__(self, path=None, text=None):
+        self.path = path
+        # ((mtime, размер) файла, части); меняется одним присваиванием, поэтому
+        # параллельная отрисовка видит либо старый, либо новый шаблон целиком
+        self.compiled = (None, compile_template(text) if text is not None else None)
+
+    @classmethod
+    def from_string(cls, text):
+        return cls(text=text)
+
+    def load(self):
+        # FileNotFoundError, если шаблона нет
+        stamp, parts = self.compiled
+        if self.path is None:
+            return parts
+        stat = os.stat(self.path)
+        current = (stat.st_mtime_ns, stat.st_size)
+        if current != stamp:
+            with open(self.path, "r", encoding="utf-8") as f:
+                parts = compile_template(f.read())
+            self.compiled = (current, parts)
+        return parts
+
+    def render(self, **values):
+        # значения - str или bytes; неизвестные подстановки остаются в тексте как есть
+        encoded = {}
+        for name, value in values.items():
+            encoded[name] = value if isinstance(value, bytes) else str(value).encode("utf-8")
+        chunks = []
+        for part in self.load():
+            if isinstance(part, bytes):
+                chunks.append(part)
+            else:
+                chunks.append(encoded.get(part, b"{{%s}}" % part.encode("ascii")))
+        return b"".join(chunks)